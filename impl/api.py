@@ -0,0 +1,117 @@
+# SPDX-License-Identifier: MIT
+'''
+Library interface, to color text from Python programs without running neurocat.py:
+
+    from impl import api
+
+    print(api.color('a purple pufferfish'))
+    for chunk in api.color_stream(chunks):
+        sys.stdout.write(chunk)
+
+    logging.getLogger().addHandler(api.ColorHandler())
+
+By default everything uses shared(): one Neurocat instance per process, loaded on first use,
+so that its word caches stay warm between calls.
+'''
+import logging
+import threading
+
+from .cache import LRUCache
+from .color_assoc import ColorAssoc
+from .fun_color import Colorizer, WordCache, palette
+from .term_util import AnsiWriter
+from .word_db import WordDB
+
+class Neurocat:
+    '''
+    Colors text with escape sequences for the terminal, like neurocat.py. The color table and word
+    database are loaded once. `multicolor` and `colors` are as for neurocat.py. Besides the words,
+    the last `line_cache_size` distinct lines are cached, as log messages tend to repeat.
+    Can be used from several threads; coloring is serialized, the caches aren't thread-safe.
+    '''
+    def __init__(self, multicolor=True, colors='truecolor', cache_size=65536, line_cache_size=4096):
+        self.cas = ColorAssoc()
+        self.wdb = WordDB(readonly=True)
+        ranked = self.wdb.rankings_status(self.cas.fingerprint) == 'ok'
+        self.colorizer = Colorizer(self.cas, self.wdb, fallback=True, multicolor=multicolor, ranked=ranked, cache=WordCache(cache_size))
+        self.writer = AnsiWriter(None, palette(self.cas), colors=colors) # only for render_line
+        self.lines = LRUCache(line_cache_size)
+        self.lock = threading.Lock()
+
+    def color_line(self, line):
+        '''Color a line of text (without newline).'''
+        with self.lock:
+            colored = self.lines.get(line)
+            if colored is None:
+                colored = self.writer.render_line(self.colorizer.line_spans(line))[:-1]
+                self.lines.put(line, colored)
+        return colored
+
+    def color(self, text):
+        '''Color text of any number of lines.'''
+        if '\n' not in text:
+            return self.color_line(text)
+        lines = text.split('\n')
+        with self.lock:
+            self.colorizer.prepare(lines)
+        return '\n'.join(self.color_line(line) for line in lines)
+
+    def stream(self, chunks):
+        '''
+        Color an iterable of text chunks, yielding colored chunks. Lines are colored as soon as
+        they are complete, the last one (if it has no newline) at the end.
+        '''
+        pending = ''
+        for chunk in chunks:
+            data = pending + chunk
+            end = data.rfind('\n') + 1
+            pending = data[end:]
+            if end:
+                yield self.color(data[:end - 1]) + '\n'
+        if pending:
+            yield self.color(pending)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def shared():
+    '''The Neurocat instance with default options shared by the whole process, created on first use.'''
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = Neurocat()
+    return _shared
+
+def color(text):
+    '''Color text with the shared instance, see Neurocat.color.'''
+    return shared().color(text)
+
+def color_stream(chunks):
+    '''Color an iterable of text chunks with the shared instance, see Neurocat.stream.'''
+    return shared().stream(chunks)
+
+class ColorFormatter(logging.Formatter):
+    '''
+    logging.Formatter that colors the message of every record, but not the rest of the format such
+    as the time and level, with `neurocat` (a Neurocat, by default the shared instance).
+    '''
+    def __init__(self, fmt=None, datefmt=None, style='%', neurocat=None):
+        super().__init__(fmt, datefmt, style)
+        self.neurocat = neurocat
+
+    def formatMessage(self, record):
+        neurocat = self.neurocat or shared()
+        # format() sets record.message for every handler, so it can be swapped out here
+        message = record.message
+        record.message = neurocat.color(message)
+        try:
+            return super().formatMessage(record)
+        finally:
+            record.message = message
+
+class ColorHandler(logging.StreamHandler):
+    '''logging.StreamHandler (to standard error by default) with a ColorFormatter.'''
+    def __init__(self, stream=None, fmt=None, neurocat=None):
+        super().__init__(stream)
+        self.setFormatter(ColorFormatter(fmt, neurocat=neurocat))
@@ -0,0 +1,102 @@
+# SPDX-License-Identifier: MIT
+'''
+Pure-Python byte pair encoding, compatible with the CLIP tokenizer, so that text can be split
+into CLIP tokens without torch or transformers.
+'''
+import functools
+import math
+import re
+
+END_OF_WORD = '</w>'
+
+# CLIP's pre-tokenization pattern, with \p{L} and \p{N} approximated by Python's character classes
+_piece_re = re.compile(r"'s|'t|'re|'ve|'m|'ll|'d|[^\W\d_]+|\d|[^\s\w]+|_+", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=None)
+def bytes_to_unicode():
+    '''
+    Reversible mapping of bytes to printable characters, as used for the vocabulary: printable
+    Latin-1 characters stand for themselves, the other bytes are moved to U+0100 and up.
+    '''
+    bs = list(range(ord('!'), ord('~') + 1)) + list(range(ord('¡'), ord('¬') + 1)) + list(range(ord('®'), ord('ÿ') + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+def read_merges(path):
+    '''Read a merges file (one space-separated pair per line, highest priority first) into a rank table.'''
+    ranks = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#version') or not line.strip():
+                continue
+            first, second = line.split()
+            ranks[(first, second)] = len(ranks)
+    return ranks
+
+def write_merges(path, ranks):
+    '''Write a rank table as read by read_merges.'''
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('#version: 0.2\n')
+        for first, second in sorted(ranks, key=ranks.get):
+            f.write(f'{first} {second}\n')
+
+class BPE:
+    '''
+    CLIP byte pair encoder. `ranks` maps pairs of symbols to their merge priority, see read_merges.
+    Encodings of the last `cache_size` distinct pieces are kept.
+    '''
+    def __init__(self, ranks, cache_size=65536):
+        self.ranks = ranks
+        self.byte_encoder = bytes_to_unicode()
+        self.bpe = functools.lru_cache(maxsize=cache_size)(self._bpe)
+
+    def _bpe(self, piece):
+        '''Merge the (byte-encoded) characters of a piece into tokens, the last one marked as end of word.'''
+        word = list(piece[:-1]) + [piece[-1] + END_OF_WORD]
+        while len(word) > 1:
+            first, second = min(zip(word, word[1:]), key=lambda pair: self.ranks.get(pair, math.inf))
+            if (first, second) not in self.ranks:
+                break
+            merged = []
+            i = 0
+            while i < len(word):
+                if i < len(word) - 1 and word[i] == first and word[i + 1] == second:
+                    merged.append(first + second)
+                    i += 2
+                else:
+                    merged.append(word[i])
+                    i += 1
+            word = merged
+        return tuple(word)
+
+    def tokens(self, text):
+        '''
+        Split text into tokens. Returns a list of (token, start, end) with the vocabulary entry of
+        every token, and the range of characters of the lowercased text it covers. A character that
+        is split between tokens is attributed to the first of them.
+        '''
+        text = text.lower()
+        result = []
+        for match in _piece_re.finditer(text):
+            piece = match.group()
+            data = piece.encode('utf-8')
+            # character (relative to the piece) that each byte belongs to
+            owner = [i for i, ch in enumerate(piece) for _ in ch.encode('utf-8')]
+            pos = 0
+            prev_end = match.start()
+            tokens = self.bpe(''.join(self.byte_encoder[b] for b in data))
+            for i, token in enumerate(tokens):
+                size = len(token) - (len(END_OF_WORD) if i == len(tokens) - 1 else 0)
+                start = max(match.start() + owner[pos], prev_end)
+                end = match.start() + owner[pos + size - 1] + 1
+                pos += size
+                if start < end:
+                    result.append((token, start, end))
+                    prev_end = end
+        return result
@@ -0,0 +1,40 @@
+# SPDX-License-Identifier: MIT
+from collections import OrderedDict
+
+class LRUCache:
+    '''
+    Bounded least-recently-used cache, with hit/miss/eviction counters.
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        '''Check for key, without counting it as a use.'''
+        return key in self.data
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value=None):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {'size': len(self.data), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
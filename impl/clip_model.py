@@ -1,6 +1,4 @@
 # SPDX-License-Identifier: MIT
-import sys
-
 import numpy
 
 from .clip_util import normalize
@@ -30,6 +28,35 @@ class TextModel:
         text_embeddings = self.text_encoder(input_ids.to(self.text_encoder.device))
         return normalize(text_embeddings.text_embeds[0].detach().cpu().numpy())
 
+    def embeddings_from_texts(self, texts):
+        '''
+        Compute embeddings for a batch of texts at once. Inputs are padded only to the longest text
+        in the batch. Returns a matrix with one normalized embedding per row.
+        '''
+        text_input = self.tokenizer(list(texts), padding="longest", truncation=False, return_tensors="pt")
+        if text_input.input_ids.shape[1] > self.tokenizer.model_max_length:
+            raise ValueError(f"Input too long ({text_input.input_ids.shape[1]} > {self.tokenizer.model_max_length})")
+
+        return self._embed(text_input.input_ids, text_input.attention_mask)
+
+    def embeddings_from_token_ids(self, token_ids):
+        '''
+        Compute embeddings for a batch of single tokens, each encoded as a text of its own.
+        Returns a matrix with one normalized embedding per row.
+        '''
+        import torch
+        bos, eos = self.tokenizer.bos_token_id, self.tokenizer.eos_token_id
+        return self._embed(torch.tensor([[bos, token_id, eos] for token_id in token_ids]))
+
+    def _embed(self, input_ids, attention_mask=None):
+        import torch
+        with torch.inference_mode():
+            text_embeddings = self.text_encoder(
+                input_ids=input_ids.to(self.text_encoder.device),
+                attention_mask=None if attention_mask is None else attention_mask.to(self.text_encoder.device))
+            m = text_embeddings.text_embeds.float().cpu().numpy()
+        return m / numpy.maximum(numpy.sqrt(numpy.sum(m * m, axis=1, keepdims=True)), 1e-8)
+
 class VisionModel:
     def __init__(self, device):
         ''''Load vision model.'''
@@ -43,10 +70,17 @@ class VisionModel:
         logging.set_verbosity_warning()
 
     def embedding_from_image(self, image):
-        from PIL import Image
-
         inputs = self.processor(images=image, return_tensors="pt")
 
         inputs.to(self.image_encoder.device)
         outputs = self.image_encoder(**inputs)
         return normalize(outputs.image_embeds[0].detach().cpu().numpy())
+
+    def embeddings_from_images(self, images):
+        '''Compute embeddings for a batch of images at once. Returns a matrix with one normalized embedding per row.'''
+        import torch
+        inputs = self.processor(images=list(images), return_tensors="pt")
+        inputs.to(self.image_encoder.device)
+        with torch.inference_mode():
+            m = self.image_encoder(**inputs).image_embeds.float().cpu().numpy()
+        return m / numpy.maximum(numpy.sqrt(numpy.sum(m * m, axis=1, keepdims=True)), 1e-8)
@@ -1,7 +1,9 @@
 # SPDX-License-Identifier: MIT
 import sys
 
-import numpy
+from .lazy import lazy_import
+
+numpy = lazy_import('numpy')
 
 def normalize(v):
     '''Normalize a vector (L2 norm).'''
@@ -1,35 +1,210 @@
 # SPDX-License-Identifier: MIT
-import numpy as np
+import functools
+import hashlib
+import io
+import json
+import os
+import shutil
 
 from .clip_util import normalize
 from . import resource
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+def colorfulness(scores, ac_scores):
+    '''
+    How much the strongest color association stands out from the abstract color, in [0..1],
+    for each row of scores.
+    '''
+    min_scores = scores.min(axis=-1)
+    max_scores = scores.max(axis=-1)
+    return 1.0 - (ac_scores - min_scores) / (max_scores - min_scores)
+
+def rank(scores, top_k=None):
+    '''Rank the colors for every row of scores, most strongly associated first, optionally only the first `top_k`.'''
+    n = scores.shape[1]
+    if top_k is None or top_k >= n:
+        # same order as reversed(argsort(scores)) per row
+        return np.argsort(scores, axis=1)[:, ::-1]
+    top = np.argpartition(scores, n - top_k, axis=1)[:, n - top_k:]
+    order = np.argsort(np.take_along_axis(scores, top, axis=1), axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+# version of the derived color tables cached in data/colors.cache, bump when _prepare changes
+CACHE_VERSION = 3
+_TABLES = ['rgbs', 'v', 'v_sub', 'abstract', 'v_coords', 'v_basis', 'v_sub_coords', 'v_sub_basis']
+
+# palettes with more colors than this are scored through a low-rank factorization, see _low_rank
+LOW_RANK_MIN_COLORS = 1024
+
+def _low_rank(v, energy=0.9999):
+    '''
+    Factor a color matrix as coords @ basis, with the smallest rank that keeps `energy` of its
+    squared norm. Scoring an embedding then costs rank * (colors + dimension) instead of colors *
+    dimension multiplications; solid color embeddings are close to a low-dimensional subspace.
+    Returns empty factors if the palette is small, or if this doesn't save anything.
+    '''
+    n, dim = v.shape
+    if n > LOW_RANK_MIN_COLORS:
+        u, s, vt = np.linalg.svd(v, full_matrices=False)
+        cumulative = np.cumsum(s * s) / np.sum(s * s)
+        r = min(int(np.searchsorted(cumulative, energy)) + 1, len(s))
+        if r * (n + dim) < n * dim:
+            return (u[:, :r] * s[:r]).astype(np.float32), vt[:r].astype(np.float32)
+    return np.zeros((n, 0), dtype=np.float32), np.zeros((0, dim), dtype=np.float32)
+_tables = {} # per process, by source hash
+
+def _prepare(data):
+    '''Compute the derived color tables from the contents of colors.npy.'''
+    f = io.BytesIO(data)
+    rgbs = np.load(f, allow_pickle=False)
+    v = np.load(f, allow_pickle=False).astype(np.float32)
+
+    # compute abstract color (midpoint between our colors)
+    #abstract = normalize(sum(v))
+    # compute abstract color (vector that results in the flattest spectrum "no color info")
+    m = np.linalg.lstsq(v, np.ones(len(v)), rcond=None)[0]
+    abstract = normalize(m)
+    v_sub = v.copy()
+    for idx in range(len(v_sub)):
+        v_sub[idx] = normalize(v_sub[idx] - abstract)
+    tables = {'rgbs': rgbs, 'v': v, 'v_sub': v_sub, 'abstract': abstract}
+    for name in ['v', 'v_sub']:
+        tables[f'{name}_coords'], tables[f'{name}_basis'] = _low_rank(tables[name])
+    return tables
+
+def _write_cache(path, tables, digest):
+    tmp = path.with_name(f'{path.name}.tmp-{os.getpid()}')
+    tmp.mkdir()
+    for name in _TABLES:
+        np.save(tmp / f'{name}.npy', tables[name], allow_pickle=False)
+    with open(tmp / 'meta.json', 'w') as f:
+        # the palette is small, and available from here without loading numpy
+        json.dump({'version': CACHE_VERSION, 'source': digest, 'rgbs': tables['rgbs'].tolist()}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(tmp, path)
+    except OSError: # another process got there first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _cache_meta(digest):
+    '''Metadata of the color table cache if it's up to date, otherwise None.'''
+    try:
+        with open(resource.filename('colors.cache') / 'meta.json', 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION or meta.get('source') != digest:
+        return None
+    return meta
+
+def _load_tables(data, digest):
+    '''
+    Load the derived color tables, memory-mapped from the cache next to colors.npy if it's up to date,
+    otherwise compute them and update the cache.
+    '''
+    tables = _tables.get(digest)
+    if tables is not None:
+        return tables
+
+    path = resource.filename('colors.cache')
+    if _cache_meta(digest) is not None:
+        try:
+            tables = {name: np.asarray(np.load(path / f'{name}.npy', mmap_mode='r', allow_pickle=False)) for name in _TABLES}
+        except (OSError, ValueError):
+            pass
+    if tables is None:
+        tables = _prepare(data)
+        try:
+            _write_cache(path, tables, digest)
+        except OSError:
+            pass # e.g. read-only installation, just don't cache
+
+    _tables[digest] = tables
+    return tables
 
 class ColorAssoc:
+    '''
+    Color vectors, and scoring of embeddings against them.
+    The vectors are only loaded when first used, so that rendering from precomputed
+    rankings needs nothing but the palette. Large palettes are scored through a low-rank
+    factorization of the vectors (see _low_rank), so that scoring costs about the same as for
+    the default palette.
+    '''
     def __init__(self, subtract_abstract=True):
         self.subtract_abstract = subtract_abstract
 
         with resource.open('colors.npy', 'rb') as f:
-            self.rgbs = np.load(f, allow_pickle=False)
-            self.v = np.load(f, allow_pickle=False).astype(np.float32)
-
-        self.rgbs = [tuple(col) for col in self.rgbs]
-        # compute abstract color (midpoint between our colors)
-        #self.abstract_color = normalize(sum(self.v))
-        # compute abstract color (vector that results in the flattest spectrum "no color info")
-        m = np.linalg.lstsq(self.v, np.ones(len(self.v)), rcond=None)[0]
-        self.abstract_color = normalize(m)
-        if subtract_abstract:
-            for idx in range(len(self.v)):
-                self.v[idx] = normalize(self.v[idx] - self.abstract_color)
-            self.abstract_color = np.zeros(m.shape)
+            self._data = f.read()
+        self._digest = hashlib.sha256(self._data).hexdigest()
+        # identifies the color table and preprocessing, for derived data such as ranking tables
+        self.fingerprint = f'{self._digest}:{int(subtract_abstract)}'
+
+        meta = _cache_meta(self._digest)
+        if meta is not None:
+            rgbs = meta['rgbs']
+        else:
+            rgbs = self._tables()['rgbs'].tolist()
+        self.rgbs = [tuple(col) for col in rgbs]
+        self.rgb_index = {}
+        for i, col in enumerate(self.rgbs):
+            self.rgb_index.setdefault(col, i)
+
+    def _tables(self):
+        return _load_tables(self._data, self._digest)
+
+    @functools.cached_property
+    def v(self):
+        return self._tables()['v_sub' if self.subtract_abstract else 'v']
+
+    @functools.cached_property
+    def factors(self):
+        '''(coords, basis) with coords @ basis approximately v, or None if v is used as-is.'''
+        name = 'v_sub' if self.subtract_abstract else 'v'
+        basis = self._tables()[f'{name}_basis']
+        return (self._tables()[f'{name}_coords'], basis) if len(basis) else None
+
+    @functools.cached_property
+    def abstract_color(self):
+        abstract = self._tables()['abstract']
+        return np.zeros(abstract.shape) if self.subtract_abstract else abstract
 
     def compute_scores(self, m):
-        scores = np.matmul(self.v, m)
+        if self.factors is not None:
+            coords, basis = self.factors
+            scores = np.matmul(coords, np.matmul(basis, m))
+        else:
+            scores = np.matmul(self.v, m)
         ac_score = np.dot(self.abstract_color, m)
         return scores, ac_score
 
+    def compute_scores_batch(self, m):
+        '''Compute scores for a matrix of embeddings (one per row) at once.'''
+        if self.factors is not None:
+            coords, basis = self.factors
+            scores = np.matmul(np.matmul(m, basis.T), coords.T)
+        else:
+            scores = np.matmul(m, self.v.T)
+        ac_scores = np.matmul(m, self.abstract_color)
+        return scores, ac_scores
+
+    def rank_batch(self, m, top_k=None):
+        '''
+        Score a matrix of embeddings (one per row) and rank the colors for each of them.
+        Returns (scores, rankings, colorfulness), where every row of rankings is a list of color
+        indices, most strongly associated first. If `top_k` is given, only the first `top_k`
+        colors are ranked.
+        '''
+        scores, ac_scores = self.compute_scores_batch(m)
+        return scores, rank(scores, top_k), colorfulness(scores, ac_scores)
+
     def lookup_color(self, rgb):
-        for i, c in enumerate(self.rgbs):
-            if c == rgb:
-                return self.v[i]
-        raise KeyError
+        return self.v[self.rgb_index[tuple(rgb)]]
+
+    def nearest_index(self, rgb):
+        '''Index of the color `rgb`, or of the nearest color in the palette if it isn't in it.'''
+        idx = self.rgb_index.get(tuple(rgb))
+        if idx is None:
+            idx = min(range(len(self.rgbs)), key=lambda i: sum((a - b) ** 2 for a, b in zip(self.rgbs[i], rgb)))
+        return idx
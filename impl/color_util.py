@@ -1,6 +1,10 @@
 # SPDX-License-Identifier: MIT
 import colorsys
 
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
 def hex_to_rgb(rgbhex):
     if rgbhex[0] == '#':
         rgbhex = rgbhex[1:]
@@ -36,3 +40,54 @@ def normalize_color(col, strength=255):
 
     col = [max(min(col[i], 255), 0) for i in range(3)]
     return tuple(col)
+
+def all_colors_rgb(hues=24, levels=3, greys=9):
+    '''
+    The palette of solid colors that neurocat associates words with: a ramp of `greys` greys, and
+    `hues` hues at `levels` levels of brightness and saturation each. The default is 225 colors.
+    '''
+    # grey ramp
+    colors = []
+    for val in np.linspace(0.0, 1.0, greys):
+        colors.append(hsv_to_rgb8(0.0, 0.0, val))
+    # brightness levels
+    for val in np.linspace(0.0, 1.0, levels + 1)[1:]:
+        # saturation levels
+        for sat in np.linspace(0.0, 1.0, levels + 1)[1:]:
+            for hue in np.linspace(0.0, 1.0, hues + 1)[:-1]:
+                colors.append(hsv_to_rgb8(hue, sat, val))
+
+    return colors
+
+def rgb_to_lab(rgbs):
+    '''Convert an (n, 3) array of 8-bit sRGB colors to CIELAB (D65).'''
+    c = np.asarray(rgbs, dtype=np.float64) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([
+        [0.4124, 0.2126, 0.0193],
+        [0.3576, 0.7152, 0.1192],
+        [0.1805, 0.0722, 0.9505],
+    ]) / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+def nearest_colors(rgbs, candidates):
+    '''For every color in `rgbs`, the index of the perceptually nearest color (CIE76) in `candidates`.'''
+    a = rgb_to_lab(rgbs)
+    b = rgb_to_lab(candidates)
+    dist = np.sum((a[:, None, :] - b[None, :, :]) ** 2, axis=2)
+    return np.argmin(dist, axis=1)
+
+# xterm's default 16 system colors
+XTERM_16 = [
+    (0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0), (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+    (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0), (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255),
+]
+
+def xterm_256():
+    '''RGB values of the xterm 256-color palette.'''
+    levels = [0, 95, 135, 175, 215, 255]
+    colors = list(XTERM_16)
+    colors += [(r, g, b) for r in levels for g in levels for b in levels]
+    colors += [(8 + 10 * i,) * 3 for i in range(24)]
+    return colors
@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: MIT
+'''
+neurocat server protocol.
+
+The client connects to the server's Unix domain socket and sends a header line with the options
+as a JSON object, followed by the text to color. It shuts down its sending side at the end of
+the input. The server answers with a status line, a JSON object whose `error` is null or a
+message saying what is wrong with the request. Unless there is an error, it then sends back
+the colored text as it goes. It closes the connection when done.
+Text is UTF-8 and passed through byte-transparently.
+
+This module is imported by the client, so it must not import anything heavy.
+'''
+import os
+import stat
+
+ENCODING = 'utf-8'
+ERRORS = 'surrogateescape'
+
+# options that the client can set, with their defaults
+OPTIONS = {
+    'multicolor': 1,
+    'colors': 'truecolor', # see term_util.COLOR_MODES
+}
+
+def socket_path():
+    '''
+    Default socket path: in $XDG_RUNTIME_DIR, or else in a directory of this user's own in /tmp,
+    see make_socket_dir.
+    '''
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'neurocat.sock')
+    return os.path.join(f'/tmp/neurocat-{os.getuid()}', 'neurocat.sock')
+
+def _check_dir(path):
+    '''
+    Raise PermissionError unless `path` is a directory owned by this user (or root) that nobody
+    else can add files to or rename files in, so that another user can't put a socket there.
+    '''
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f'{path} is not a directory')
+    if st.st_uid not in (os.getuid(), 0):
+        raise PermissionError(f'{path} is owned by another user')
+    if st.st_mode & 0o022 and not st.st_mode & stat.S_ISVTX:
+        raise PermissionError(f'{path} is writable by other users')
+
+def make_socket_dir(path):
+    '''Create the directory for the socket `path` if needed, private to this user, and check it.'''
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    _check_dir(directory)
+
+def check_socket(path):
+    '''
+    Raise PermissionError unless `path` is a socket of this user in a safe directory, so that the
+    client doesn't talk to a server of someone else. Raises FileNotFoundError if it doesn't exist.
+    '''
+    _check_dir(os.path.dirname(os.path.abspath(path)))
+    st = os.lstat(path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f'{path} is not a socket of this user')
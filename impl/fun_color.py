@@ -1,8 +1,15 @@
 # SPDX-License-Identifier: MIT
-import numpy
+import itertools
+import re
+import time
 
+from . import color_assoc
+from .cache import LRUCache
+from .lazy import lazy_import
 from .term_util import colorize
 
+numpy = lazy_import('numpy')
+
 def _do_boost_dark(fg):
     if fg == (0, 0, 0): # change black to some dark grey color
         fg = (80, 80, 80)
@@ -12,56 +19,324 @@ def _do_boost_dark(fg):
         fg = [min(x, 255) for x in fg]
     return fg
 
-def fun_color(cas, wdb, line, m=None, highlight_unknown=True, boost_dark=True, fallback=False, multicolor=True, min_colorfulness=None):
+def _fallback_candidates(word):
+    '''(rule, word) pairs to try in order if a word isn't known as-is.'''
+    # fall back to remove 's' works sometimes (plurals)
+    if word.endswith('ic'):
+        return [('-ic', word[0:-2])]
+    elif word.endswith('es'):
+        return [('-es', word[0:-2]), ('-s', word[0:-1])]
+    elif word.endswith('s'):
+        return [('-s', word[0:-1])]
+    return []
+
+def _lookup_fallback(lookup, word, fallback, stats=None):
+    if stats is not None:
+        return _lookup_fallback_stats(lookup, word, fallback, stats)
+    result = lookup(word)
+    if result is None and fallback:
+        for _, key in _fallback_candidates(word):
+            result = lookup(key)
+            if result is not None:
+                break
+    return result
+
+def _lookup_fallback_stats(lookup, word, fallback, stats):
+    start = time.perf_counter()
+    rules = [('exact', word)]
+    if fallback:
+        rules += _fallback_candidates(word)
+    for rule, key in rules:
+        result = lookup(key)
+        stats.count(f'lookup {rule} {"miss" if result is None else "hit"}')
+        if result is not None:
+            break
+    stats.add_time('color: lookup', time.perf_counter() - start)
+    return result
+
+def palette(cas, boost_dark=True):
+    '''Foreground colors to render each color index of `cas` with.'''
+    if boost_dark:
+        return [_do_boost_dark(fg) for fg in cas.rgbs]
+    else:
+        return list(cas.rgbs)
+
+class WordCache:
+    '''
+    Cache of colored words for color_word, and a negative cache of unknown words so that
+    the fallback lookups happen only once per distinct word. Colorizer also keeps the
+    colors of tokenized and approximated unknown words in it.
+    A cache must only be used with one pair of ColorAssoc and WordDB.
+    '''
+    def __init__(self, maxsize=65536, unknown_maxsize=65536):
+        self.colored = LRUCache(maxsize)
+        self.unknown = LRUCache(unknown_maxsize)
+        self.tokenized = LRUCache(unknown_maxsize)
+        self.approximated = LRUCache(unknown_maxsize)
+
+    def stats(self):
+        return {'colored': self.colored.stats(), 'unknown': self.unknown.stats(), 'tokenized': self.tokenized.stats(),
+            'approximated': self.approximated.stats()}
+
+def color_word(cas, wdb, word, m=None, fallback=False, multicolor=True, min_colorfulness=None, ranked=False, cache=None, stats=None):
     '''
     Outrageous word-coloring algorithm.
+    Returns a sequence of (color index, text) spans, with color index None for uncolored text,
+    or None if the word is unknown.
     If `multicolor` is set, color each letter, otherwise color only the entire word.
+    If `ranked` is set, use the precomputed ranking table in `wdb` instead of scoring
+    the embedding (see neurocat_build_rankings.py).
+    If `cache` (a WordCache) is passed, results are looked up in and added to it.
+    If `stats` (a Stats) is passed, lookups and scoring are counted and timed.
     '''
-    if m is None:
-        m = wdb.lookup(line)
+    if cache is None or m is not None:
+        return _color_word(cas, wdb, word, m, fallback, multicolor, min_colorfulness, ranked, stats)
 
-    # fall back to remove 's' works sometimes (plurals)
-    if m is None and fallback:
-        if line.endswith('ic'):
-            m = wdb.lookup(line[0:-2])
-        elif line.endswith('es'):
-            m = wdb.lookup(line[0:-2])
-            if m is None:
-                m = wdb.lookup(line[0:-1])
-        elif line.endswith('s'):
-            m = wdb.lookup(line[0:-1])
-
-    if m is None:
+    # the spans are independent of how they're rendered (e.g. boost_dark), so that isn't part of the key
+    key = (word, multicolor, min_colorfulness, fallback)
+    spans = cache.colored.get(key)
+    if spans is not None:
+        return spans
+    unknown_key = (word.lower(), fallback)
+    if cache.unknown.get(unknown_key):
+        return None
+
+    spans = _color_word(cas, wdb, word, m, fallback, multicolor, min_colorfulness, ranked, stats)
+    if spans is None:
+        cache.unknown.put(unknown_key, True)
+    else:
+        spans = tuple(spans)
+        cache.colored.put(key, spans)
+    return spans
+
+def _color_word(cas, wdb, word, m, fallback, multicolor, min_colorfulness, ranked, stats, text=None):
+    # `text` is what to color, if different from the word to look up
+    text = word if text is None else text
+    if m is None and ranked:
+        ranking = _lookup_fallback(wdb.lookup_ranking, word, fallback, stats)
+        if ranking is None:
+            return None
+        indices, colorfulness = ranking
+        if len(indices) < len(text): # ranking table built with a small --top
+            indices = itertools.cycle(indices)
+    else:
+        if m is None:
+            m = _lookup_fallback(wdb.lookup, word, fallback, stats)
+        if m is None:
+            return None
+        if stats is not None:
+            start = time.perf_counter()
+        scores, ac_score = cas.compute_scores(m)
+        colorfulness = None
+        if min_colorfulness is not None:
+            colorfulness = color_assoc.colorfulness(scores, ac_score)
+        if colorfulness is not None and colorfulness < min_colorfulness:
+            indices = None # not colored, no need to rank
+        elif multicolor:
+            indices = numpy.argsort(scores)[::-1]
+        else:
+            indices = [numpy.argmax(scores)]
+        if stats is not None:
+            stats.add_time('color: score', time.perf_counter() - start)
+    return _spans(text, indices, colorfulness, multicolor, min_colorfulness)
+
+def _spans(word, indices, colorfulness, multicolor, min_colorfulness):
+    if min_colorfulness is not None and colorfulness < min_colorfulness:
+        return [(None, word)]
+
+    if multicolor:
+        return [(idx, glyph) for glyph, idx in zip(word, indices)]
+    else:
+        return [(next(iter(indices)), word)]
+
+def fun_color(cas, wdb, line, m=None, highlight_unknown=True, boost_dark=True, fallback=False, multicolor=True, min_colorfulness=None, ranked=False, cache=None):
+    '''
+    Color a word, returning a string with terminal escape sequences for every glyph.
+    See color_word for the arguments.
+    '''
+    spans = color_word(cas, wdb, line, m=m, fallback=fallback, multicolor=multicolor, min_colorfulness=min_colorfulness, ranked=ranked, cache=cache)
+    if spans is None:
         if highlight_unknown:
             return colorize((255, 255, 0), (255, 0, 0), line)
         else:
             return line
-    else:
-        scores, ac_score = cas.compute_scores(m)
 
-        if min_colorfulness is not None:
-            min_score = min(scores)
-            max_score = max(scores)
-            colorfulness = 1.0 - (ac_score - min_score) / (max_score - min_score)
-            if colorfulness < min_colorfulness:
-                return line
-
-        if multicolor:
-            indices = numpy.argsort(scores)
-            indices = reversed(indices)
-            s = []
-            for glyph, idx in zip(line, indices):
-                fg = cas.rgbs[idx]
-                bg = (0, 0, 0)
-                if boost_dark:
-                    fg = _do_boost_dark(fg)
-                s.append(colorize(fg, bg, glyph))
-            return ''.join(s)
-        else:
-            idx = numpy.argmax(scores)
-            fg = cas.rgbs[idx]
-            if boost_dark:
-                fg = _do_boost_dark(fg)
-            bg = (0, 0, 0)
-            return colorize(fg, bg, line)
+    s = []
+    for idx, text in spans:
+        if idx is None:
+            s.append(text)
+            continue
+        fg = cas.rgbs[idx]
+        bg = (0, 0, 0)
+        if boost_dark:
+            fg = _do_boost_dark(fg)
+        s.append(colorize(fg, bg, text))
+    return ''.join(s)
+
+def read_word_list(path):
+    '''Lowercased words of a file with one word per line, ignoring empty lines and # comments.'''
+    with open(path, 'r') as f:
+        return frozenset(w.lower() for w in (line.strip() for line in f) if w and not w.startswith('#'))
+
+_word_re = re.compile(r'(\W+)')
+
+class Colorizer:
+    '''
+    Colors lines of text word by word, see color_word for the arguments.
+    Words in `common_words` (a set of lowercase words, see read_word_list) and words of three
+    letters or less are skipped if `common_words` is given. They aren't looked up at all, so they
+    cost no more than text between words.
+    If `min_colorfulness` is given, words whose colorfulness (see color_assoc.colorfulness) is lower
+    are left uncolored. With the ranking table this is the value stored with the ranking.
+    If `tokens` (a TokenDB) is given, unknown words are colored per CLIP token.
+    If `approximate` (an NgramIndex) is given, unknown words (that can't be tokenized) are
+    colored after the known words spelled most like them.
+    '''
+    def __init__(self, cas, wdb, fallback=True, multicolor=True, min_colorfulness=None, ranked=False, cache=None, common_words=None, stats=None,
+            approximate=None, tokens=None):
+        self.cas = cas
+        self.wdb = wdb
+        self.fallback = fallback
+        self.multicolor = multicolor
+        self.min_colorfulness = min_colorfulness
+        self.ranked = ranked
+        self.cache = cache
+        self.common_words = common_words
+        self.stats = stats
+        self.approximate = approximate
+        self.tokens = tokens
+        self.tokens_ranked = tokens is not None and tokens.wdb.rankings_status(cas.fingerprint) == 'ok'
+
+    def _skip(self, word):
+        return self.common_words is not None and (len(word) <= 3 or word.lower() in self.common_words)
+
+    def prepare(self, lines):
+        '''
+        Look up and score all words in a block of lines not yet in the cache at once,
+        so that line_spans finds them in the cache.
+        '''
+        if self.ranked or self.cache is None: # nothing to score
+            return
+        todo = {}
+        for line in lines:
+            for word in _word_re.split(line)[::2]:
+                if word in todo or self._skip(word):
+                    continue
+                key = (word, self.multicolor, self.min_colorfulness, self.fallback)
+                unknown_key = (word.lower(), self.fallback)
+                if key in self.cache.colored or unknown_key in self.cache.unknown:
+                    continue
+                todo[word] = [('exact', word)] + (_fallback_candidates(word) if self.fallback else [])
+        if not todo:
+            return
+
+        # look up all words and their fallbacks in one go
+        if self.stats is not None:
+            start = time.perf_counter()
+        keys = list({key.lower() for rules in todo.values() for _, key in rules})
+        m, found = self.wdb.lookup_many(keys)
+        row = {key: i for i, key in enumerate(keys)}
+        words = []
+        rows = []
+        for word, rules in todo.items():
+            for rule, key in rules:
+                i = row[key.lower()]
+                if self.stats is not None:
+                    self.stats.count(f'lookup {rule} {"hit" if found[i] else "miss"}')
+                if found[i]:
+                    words.append(word)
+                    rows.append(i)
+                    break
+            else:
+                self.cache.unknown.put((word.lower(), self.fallback), True)
+        if self.stats is not None:
+            self.stats.add_time('color: lookup', time.perf_counter() - start)
+        if not words:
+            return
+
+        top_k = max(len(word) for word in words) if self.multicolor else 1
+        if self.stats is not None:
+            start = time.perf_counter()
+        _, rankings, colorfulness = self.cas.rank_batch(m[rows], top_k)
+        if self.stats is not None:
+            self.stats.add_time('color: score', time.perf_counter() - start)
+        for word, indices, c in zip(words, rankings.tolist(), colorfulness.tolist()):
+            key = (word, self.multicolor, self.min_colorfulness, self.fallback)
+            self.cache.colored.put(key, tuple(_spans(word, indices, c, self.multicolor, self.min_colorfulness)))
+
+    def line_spans(self, line):
+        '''Return a list of (color index, text) spans for a line of text.'''
+        words = _word_re.split(line)
+        spans = []
+        for idx, word in enumerate(words):
+            if idx % 2 == 0 and not self._skip(word):
+                colored = color_word(self.cas, self.wdb, word, fallback=self.fallback, multicolor=self.multicolor,
+                    min_colorfulness=self.min_colorfulness, ranked=self.ranked, cache=self.cache, stats=self.stats)
+                if colored is None and self.tokens is not None and word:
+                    colored = self._tokenized(word)
+                if colored is None and self.approximate is not None and word:
+                    colored = self._approximated(word)
+                if self.stats is not None and word:
+                    self.stats.count('words')
+                    if colored is None:
+                        self.stats.count('unknown words')
+                if colored is not None:
+                    spans.extend(colored)
+                    continue
+            spans.append((None, word))
+        return spans
+
+    def _tokenized(self, word):
+        '''Spans for an unknown word colored per token, or None if none of its tokens are known.'''
+        key = (word, self.multicolor, self.min_colorfulness)
+        spans = self.cache.tokenized.get(key) if self.cache is not None else None
+        if spans is None:
+            if self.stats is not None:
+                start = time.perf_counter()
+            spans = ()
+            if len(word.lower()) == len(word): # token positions are in the lowercased word
+                spans = []
+                pos = 0
+                known = False
+                for token, token_start, token_end in self.tokens.bpe.tokens(word):
+                    if token_start > pos:
+                        spans.append((None, word[pos:token_start]))
+                    text = word[token_start:token_end]
+                    colored = _color_word(self.cas, self.tokens.wdb, token, None, False, self.multicolor, self.min_colorfulness,
+                        self.tokens_ranked, None, text=text)
+                    if colored is not None:
+                        spans.extend(colored)
+                        known = True
+                    else:
+                        spans.append((None, text))
+                    pos = token_end
+                if pos < len(word):
+                    spans.append((None, word[pos:]))
+                spans = tuple(spans) if known else ()
+            if self.stats is not None:
+                self.stats.add_time('color: tokens', time.perf_counter() - start)
+            if self.cache is not None:
+                self.cache.tokenized.put(key, spans)
+        if self.stats is not None and spans:
+            self.stats.count('tokenized words')
+        return spans or None
 
+    def _approximated(self, word):
+        '''Spans for an unknown word from its approximated embedding, or None.'''
+        key = (word, self.multicolor, self.min_colorfulness)
+        spans = self.cache.approximated.get(key) if self.cache is not None else None
+        if spans is None:
+            if self.stats is not None:
+                start = time.perf_counter()
+            m = self.approximate.embedding(self.wdb, word)
+            if self.stats is not None:
+                self.stats.add_time('color: approximate', time.perf_counter() - start)
+            spans = () # no neighbors
+            if m is not None:
+                spans = tuple(color_word(self.cas, self.wdb, word, m=m, multicolor=self.multicolor,
+                    min_colorfulness=self.min_colorfulness, stats=self.stats))
+            if self.cache is not None:
+                self.cache.approximated.put(key, spans)
+        if self.stats is not None and spans:
+            self.stats.count('approximated words')
+        return spans or None
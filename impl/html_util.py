@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: MIT
+import html
+
+from .color_util import rgb_to_hex
+from .term_util import BufferedWriter
+
+def _classes(palette):
+    '''CSS class name for every color index, colors with the same RGB value share one.'''
+    names = {}
+    return [names.setdefault(tuple(fg), f'c{idx}') for idx, fg in enumerate(palette)]
+
+def html_header(palette, title='neurocat'):
+    '''Start of an HTML document, with a style sheet that has a class for every color of `palette`.'''
+    rules = {}
+    for name, fg in zip(_classes(palette), palette):
+        rules[name] = f'.{name}{{color:{rgb_to_hex(fg)}}}'
+    return (
+        '<!DOCTYPE html>\n'
+        '<html><head><meta charset="utf-8">'
+        f'<title>{html.escape(title)}</title>\n'
+        '<style>\n'
+        'body{background:#000;color:#ccc}\n'
+        'pre i{font-style:normal}\n'
+        + '\n'.join(rules.values()) + '\n'
+        '</style></head><body><pre>'
+    )
+
+def html_footer():
+    return '</pre></body></html>\n'
+
+class HtmlWriter(BufferedWriter):
+    '''
+    Writer for colored text as HTML, with a CSS class per color, and one element per run of
+    text of the same color (an <i>, for being short). `palette` maps color indices to RGB.
+    If `standalone` is set, the output is a complete document (after close()), otherwise only the
+    contents of html_header's <pre> element, for concatenating pieces.
+    '''
+    def __init__(self, out, palette, chunk_size=65536, line_buffered=False, encoding='utf-8', errors='xmlcharrefreplace', standalone=True):
+        super().__init__(out, chunk_size, line_buffered, encoding, errors)
+        self.classes = _classes(palette)
+        self.standalone = standalone
+        if standalone:
+            self.write(html_header(palette))
+
+    def render_line(self, spans):
+        s = []
+        cur = None
+        for color, text in spans:
+            if not text:
+                continue
+            name = None if color is None else self.classes[color]
+            if name != cur:
+                if name is None and text.isspace() and cur is not None: # keep the run going
+                    s.append(text)
+                    continue
+                if cur is not None:
+                    s.append('</i>')
+                if name is not None:
+                    s.append(f'<i class={name}>') # short, there's one per glyph in multicolor mode
+                cur = name
+            s.append(html.escape(text, quote=False))
+        if cur is not None:
+            s.append('</i>')
+        s.append('\n')
+        return ''.join(s)
+
+    def close(self):
+        if self.standalone:
+            self.write(html_footer())
+        self.flush()
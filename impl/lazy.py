@@ -0,0 +1,19 @@
+# SPDX-License-Identifier: MIT
+import importlib.util
+import sys
+
+def lazy_import(name):
+    '''
+    Import a module on first attribute access, so that startup doesn't pay for heavy modules
+    (numpy) that a run may not need. Note that an `import` statement for the module loads it.
+    '''
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: MIT
+'''
+Character n-gram index over the words of the word database, to approximate the embedding of
+an unknown word from the known words that are spelled most similarly.
+
+An index is a directory containing:
+- `words.npy`: the indexed words in sorted order (fixed-width UTF-8 bytes)
+- `gram_counts.npy`: number of distinct n-grams of every word
+- `offsets.npy`, `postings.npy`: for every hash bucket, the word numbers that have an n-gram
+  hashing to it, as `postings[offsets[b]:offsets[b + 1]]`
+- `meta.json`: format version, n-gram length and number of buckets
+
+Use neurocat_build_ngrams.py to create one.
+'''
+import json
+import pathlib
+import zlib
+
+from . import resource
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+VERSION = 1
+
+def default_path():
+    return resource.filename('word-embeddings.ngrams')
+
+def ngrams(word, n):
+    '''Distinct character n-grams of a word, with start and end markers.'''
+    word = f'<{word.lower()}>'
+    return {word[i:i + n] for i in range(max(len(word) - n + 1, 1))}
+
+def _buckets(grams, num_buckets):
+    return sorted({zlib.crc32(gram.encode()) % num_buckets for gram in grams})
+
+class NgramIndex:
+    '''
+    Memory-mapped character n-gram index, see neighbors and embedding.
+    '''
+    def __init__(self, path=None):
+        path = pathlib.Path(path or default_path())
+        with open(path / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != VERSION:
+            raise ValueError(f'{path}: unsupported n-gram index version {self.meta.get("version")}')
+        self.n = self.meta['n']
+        self.num_buckets = self.meta['buckets']
+        self.words = np.load(path / 'words.npy', mmap_mode='r')
+        self.gram_counts = np.load(path / 'gram_counts.npy', mmap_mode='r')
+        self.offsets = np.load(path / 'offsets.npy', mmap_mode='r')
+        self.postings = np.load(path / 'postings.npy', mmap_mode='r')
+
+    def neighbors(self, word, k=5, min_similarity=0.5):
+        '''
+        Return up to `k` (word, similarity) pairs of indexed words most similar in spelling
+        to `word`, most similar first. Similarity is the Dice coefficient of the n-gram sets.
+        '''
+        buckets = _buckets(ngrams(word, self.n), self.num_buckets)
+        lists = [self.postings[self.offsets[b]:self.offsets[b + 1]] for b in buckets]
+        if not any(len(ids) for ids in lists):
+            return []
+        ids, overlap = np.unique(np.concatenate(lists), return_counts=True)
+        similarity = 2.0 * overlap / (len(buckets) + self.gram_counts[ids])
+        if len(ids) > k:
+            top = np.argpartition(similarity, len(ids) - k)[len(ids) - k:]
+            ids, similarity = ids[top], similarity[top]
+        order = np.argsort(similarity)[::-1]
+        return [(self.words[ids[i]].decode(), float(similarity[i])) for i in order if similarity[i] >= min_similarity]
+
+    def embedding(self, wdb, word, k=5, min_similarity=0.5):
+        '''
+        Approximate embedding for `word`: the similarity-weighted average of the embeddings of its
+        nearest neighbors in `wdb`, normalized. Returns None if there are no neighbors.
+        '''
+        total = None
+        for neighbor, similarity in self.neighbors(word, k, min_similarity):
+            m = wdb.lookup(neighbor)
+            if m is None: # index older than the database
+                continue
+            total = m * similarity if total is None else total + m * similarity
+        if total is None:
+            return None
+        return total / np.linalg.norm(total)
+
+def build(path, words, n=3, num_buckets=1 << 20, max_postings=20000):
+    '''
+    Build an index of `words` (in sorted order) in `path`. N-grams shared by more than
+    `max_postings` words say little about a word and are left out, to bound lookup time.
+    '''
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    (path / 'meta.json').unlink(missing_ok=True)
+
+    gram_counts = np.empty(len(words), dtype=np.uint16)
+    buckets = []
+    ids = []
+    for i, word in enumerate(words):
+        word_buckets = _buckets(ngrams(word, n), num_buckets)
+        gram_counts[i] = len(word_buckets)
+        buckets += word_buckets
+        ids += [i] * len(word_buckets)
+    buckets = np.array(buckets, dtype=np.int64)
+    ids = np.array(ids, dtype=np.int32)
+
+    counts = np.bincount(buckets, minlength=num_buckets)
+    keep = counts[buckets] <= max_postings
+    buckets, ids = buckets[keep], ids[keep]
+    order = np.argsort(buckets, kind='stable') # word numbers stay sorted within a bucket
+    offsets = np.zeros(num_buckets + 1, dtype=np.int64)
+    np.cumsum(np.bincount(buckets, minlength=num_buckets), out=offsets[1:])
+
+    max_len = max((len(word.encode()) for word in words), default=1)
+    np.save(path / 'words.npy', np.array([word.encode() for word in words], dtype=f'S{max_len}'), allow_pickle=False)
+    np.save(path / 'gram_counts.npy', gram_counts, allow_pickle=False)
+    np.save(path / 'offsets.npy', offsets, allow_pickle=False)
+    np.save(path / 'postings.npy', ids[order], allow_pickle=False)
+
+    # written last: marks the index as complete
+    with open(path / 'meta.json', 'w') as f:
+        json.dump({'version': VERSION, 'n': n, 'buckets': num_buckets}, f)
@@ -0,0 +1,89 @@
+# SPDX-License-Identifier: MIT
+'''
+Quantized embedding formats for the compact word store.
+
+- int8: every vector scaled to [-127..127] by its own maximum, with a float32 scale per vector.
+- pq: product quantization, every vector split into subspaces that each store the index of the
+  nearest of 256 trained centroids.
+'''
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+def quantize_int8(m):
+    scales = np.maximum(np.abs(m).max(axis=1), 1e-8) / 127.0
+    q = np.rint(m / scales[:, None]).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+def dequantize_int8(q, scales):
+    return q.astype(np.float32) * scales[..., None]
+
+def _split(m, n_subspaces):
+    '''View (n, d) as (n, n_subspaces, d / n_subspaces).'''
+    n, d = m.shape
+    if d % n_subspaces:
+        raise ValueError(f'Embedding dimension {d} is not divisible by {n_subspaces} subspaces')
+    return m.reshape(n, n_subspaces, d // n_subspaces)
+
+def _nearest(x, centroids):
+    '''Index of the nearest centroid for every row of x.'''
+    dist = np.sum(centroids * centroids, axis=1)[None, :] - 2.0 * np.matmul(x, centroids.T)
+    return np.argmin(dist, axis=1)
+
+def train_pq(m, n_subspaces, n_centroids=256, n_iter=15, seed=0):
+    '''Train a product quantization codebook of shape (n_subspaces, n_centroids, d / n_subspaces) on samples m.'''
+    if len(m) < n_centroids:
+        raise ValueError(f'Need at least {n_centroids} vectors to train the codebook, got {len(m)}')
+    rng = np.random.default_rng(seed)
+    sub = _split(m.astype(np.float32), n_subspaces)
+    codebook = np.empty((n_subspaces, n_centroids, sub.shape[2]), dtype=np.float32)
+    for s in range(n_subspaces):
+        x = sub[:, s]
+        centroids = x[rng.choice(len(x), n_centroids, replace=False)]
+        for _ in range(n_iter): # Lloyd's k-means
+            assignment = _nearest(x, centroids)
+            counts = np.bincount(assignment, minlength=n_centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, x)
+            used = counts > 0
+            centroids[used] = sums[used] / counts[used, None]
+        codebook[s] = centroids
+    return codebook
+
+def encode_pq(m, codebook):
+    sub = _split(m.astype(np.float32), len(codebook))
+    codes = np.empty((len(m), len(codebook)), dtype=np.uint8)
+    for s in range(len(codebook)):
+        codes[:, s] = _nearest(sub[:, s], codebook[s])
+    return codes
+
+def decode_pq(codes, codebook):
+    codes = np.atleast_2d(codes)
+    m = codebook[np.arange(len(codebook))[None, :], codes]
+    return m.reshape(len(codes), -1)
+
+class PQScorer:
+    '''
+    Scores product-quantized embeddings directly against the colors of a ColorAssoc, without
+    decoding them: every centroid is scored against every color once, and the score of
+    an embedding is the sum of the scores of its centroids.
+    '''
+    def __init__(self, codebook, cas):
+        # abstract color as an extra column, for ac_scores
+        colors = np.vstack([cas.v, cas.abstract_color[None, :]]).astype(np.float32)
+        colors = _split(colors, len(codebook))
+        # (n_subspaces, n_centroids, n_colors + 1)
+        self.lut = np.einsum('sld,csd->slc', codebook, colors)
+
+    def compute_scores_batch(self, codes):
+        scores = np.zeros((len(codes), self.lut.shape[2]), dtype=np.float32)
+        for s in range(len(self.lut)):
+            scores += self.lut[s][codes[:, s]]
+        return scores[:, :-1], scores[:, -1]
+
+def int8_compute_scores_batch(cas, q, scales):
+    '''Score int8-quantized embeddings against the colors of a ColorAssoc, scaling afterwards.'''
+    m = q.astype(np.float32)
+    scores = np.matmul(m, cas.v.T) * scales[:, None]
+    ac_scores = np.matmul(m, cas.abstract_color) * scales
+    return scores, ac_scores
@@ -1,8 +1,16 @@
 # SPDX-License-Identifier: MIT
+import os
 import pathlib
 
+def data_dir():
+    '''Data directory, can be overridden with the NEUROCAT_DATA environment variable.'''
+    path = os.environ.get('NEUROCAT_DATA')
+    if path:
+        return pathlib.Path(path)
+    return pathlib.Path(__file__).parent.parent / 'data'
+
 def filename(name):
-    return pathlib.Path(__file__).parent.parent / 'data' / name
+    return data_dir() / name
 
 _builtin_open = open
 def open(name, mode):
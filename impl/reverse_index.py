@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: MIT
+'''
+Reverse lookup: the words most strongly associated with a color.
+
+top_words scans the word database. For instant repeated queries, build() writes an index with
+the top words of every color of the palette, a directory containing:
+- `words.npy`: the top words of every color, best first (colors × k, fixed-width UTF-8 bytes)
+- `scores.npy`: their scores (colors × k, float32)
+- `meta.json`: format version, color table fingerprint and k
+
+Use neurocat_words_by_color.py to query and build it.
+'''
+import json
+import pathlib
+import re
+
+from . import word_store
+from .color_util import hex_to_rgb
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+VERSION = 1
+
+def index_path(db_path):
+    '''Default index location for a sqlite word database.'''
+    return pathlib.Path(db_path).with_suffix('.colorindex')
+
+_color_re = re.compile(r'#?[0-9a-fA-F]{6}')
+
+def parse_color(cas, spec):
+    '''
+    Palette index for a color given as #rrggbb, the nearest color of the palette of `cas`.
+    Raises ValueError if `spec` isn't of that form.
+    '''
+    if not _color_re.fullmatch(spec):
+        raise ValueError(f'Invalid color {spec!r}')
+    return cas.nearest_index(hex_to_rgb(spec))
+
+def _top(scores, k):
+    '''Indices of the `k` highest scores along the first axis, best first.'''
+    if len(scores) > k:
+        top = np.argpartition(scores, len(scores) - k, axis=0)[len(scores) - k:]
+    else:
+        top = np.broadcast_to(np.arange(len(scores)).reshape((-1,) + (1,) * (scores.ndim - 1)), scores.shape)
+    order = np.argsort(np.take_along_axis(scores, top, axis=0), axis=0)[::-1]
+    return np.take_along_axis(top, order, axis=0)
+
+def top_words(cas, wdb, colors, k=20, chunk_size=4096):
+    '''
+    Return the `k` words of `wdb` that score highest against the colors with indices `colors`
+    (by their mean score), as a list of (word, score), best first. The database is scanned in
+    chunks of `chunk_size` words, keeping only the best `k` so far, so memory use doesn't depend
+    on its size.
+    '''
+    colors = list(colors)
+    if cas.factors is not None: # score like compute_scores_batch does
+        coords, basis = cas.factors
+        v = np.matmul(coords[colors], basis)
+    else:
+        v = np.asarray(cas.v[colors])
+    best_words = []
+    best_scores = np.empty(0, dtype=np.float32)
+    for words, m in wdb.embeddings(chunk_size):
+        scores = np.concatenate([best_scores, np.matmul(m, v.T).mean(axis=1)])
+        words = best_words + list(words)
+        top = _top(scores, k)
+        best_words = [words[i] for i in top]
+        best_scores = scores[top]
+    return list(zip(best_words, best_scores.tolist()))
+
+def build(path, cas, wdb, k=100, chunk_size=1024):
+    '''
+    Write an index of the top `k` words of every color of `cas` to `path`. Like top_words, this
+    keeps only the best `k` words per color while scanning, and the words that are among them.
+    '''
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    (path / 'meta.json').unlink(missing_ok=True)
+
+    num_colors = len(cas.rgbs)
+    best_ids = np.empty((0, num_colors), dtype=np.int64)
+    best_scores = np.empty((0, num_colors), dtype=np.float32)
+    words = {} # row number to word, for the rows in best_ids
+    pos = 0
+    for chunk_words, m in wdb.embeddings(chunk_size):
+        scores, _ = cas.compute_scores_batch(m)
+        ids = np.arange(pos, pos + len(chunk_words))
+        scores = np.concatenate([best_scores, scores])
+        ids = np.concatenate([best_ids, np.broadcast_to(ids[:, None], (len(ids), num_colors))])
+        top = _top(scores, k)
+        best_scores = np.take_along_axis(scores, top, axis=0)
+        best_ids = np.take_along_axis(ids, top, axis=0)
+        words.update(zip(range(pos, pos + len(chunk_words)), chunk_words))
+        words = {i: words[i] for i in np.unique(best_ids).tolist()}
+        pos += len(chunk_words)
+
+    encoded = [[words[i].encode() for i in row] for row in best_ids.T.tolist()]
+    max_len = max((len(word) for row in encoded for word in row), default=1)
+    np.save(path / 'words.npy', np.array(encoded, dtype=f'S{max_len}').reshape(num_colors, -1), allow_pickle=False)
+    np.save(path / 'scores.npy', best_scores.T.astype(np.float32), allow_pickle=False)
+
+    # written last: marks the index as complete
+    with open(path / 'meta.json', 'w') as f:
+        json.dump({'version': VERSION, 'fingerprint': cas.fingerprint, 'k': best_scores.shape[0]}, f)
+
+class ReverseIndex:
+    '''Per-color top words index written by build(), memory-mapped.'''
+    def __init__(self, path):
+        self.path = path = pathlib.Path(path)
+        with open(path / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != VERSION:
+            raise ValueError(f'{path}: unsupported reverse index version {self.meta.get("version")}')
+        self.k = self.meta['k']
+        self.words = np.load(path / 'words.npy', mmap_mode='r')
+        self.scores = np.load(path / 'scores.npy', mmap_mode='r')
+
+    def usable(self, cas, db_path, k):
+        '''Whether the index can answer queries for the top `k` words against `cas` and the database at `db_path`.'''
+        return self.meta['fingerprint'] == cas.fingerprint and k <= self.k and word_store.is_fresh(self.path, db_path)
+
+    def top_words(self, color, k=20):
+        '''Like top_words, for a single color index.'''
+        return [(word.decode(), float(score)) for word, score in zip(self.words[color, :k], self.scores[color, :k])]
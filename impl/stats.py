@@ -0,0 +1,54 @@
+# SPDX-License-Identifier: MIT
+import collections
+import cProfile
+import sys
+import time
+
+class Stats:
+    '''
+    Counters and per-stage timers for --stats.
+    Instrumented code takes an optional Stats object, and does nothing extra if it's None.
+    '''
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.timers = collections.Counter()
+        self.start = time.perf_counter()
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add_time(self, name, seconds):
+        self.timers[name] += seconds
+
+    def as_dict(self):
+        return {'counters': dict(self.counters), 'timers': dict(self.timers)}
+
+    def merge(self, other):
+        '''Add counters and timers from as_dict() of another Stats, e.g. from a worker process.'''
+        self.counters.update(other['counters'])
+        self.timers.update(other['timers'])
+
+    def report(self, f=sys.stderr, extra=None):
+        '''Print a summary. `extra` is a dict of further sections to print, such as cache statistics.'''
+        total = time.perf_counter() - self.start
+        print(f'--- neurocat statistics ({total:.3f} s wall time)', file=f)
+        for name, seconds in sorted(self.timers.items()):
+            print(f'{name:32} {seconds:10.3f} s  {seconds / total * 100.0:5.1f}%', file=f)
+        for name, value in sorted(self.counters.items()):
+            print(f'{name:32} {value:10}', file=f)
+
+        words = self.counters['words']
+        if words:
+            print(f'{"unknown word rate":32} {self.counters["unknown words"] / words * 100.0:9.1f}%', file=f)
+        if self.counters['bytes in']:
+            print(f'{"output/input size":32} {self.counters["bytes out"] / self.counters["bytes in"]:10.2f}x', file=f)
+        for section, values in (extra or {}).items():
+            print(f'{section:32} ' + ' '.join(f'{k}={v}' for k, v in values.items()), file=f)
+
+def profile(func, filename):
+    '''Run func under cProfile, and dump the profile to `filename` (for pstats or snakeviz).'''
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func)
+    finally:
+        profiler.dump_stats(filename)
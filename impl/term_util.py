@@ -1,4 +1,9 @@
 # SPDX-License-Identifier: MIT
+import abc
+import functools
+
+from .color_util import nearest_colors, xterm_256, XTERM_16
+
 BARS_V = '  ▏▎▍▌▋▊▉█'
 BARS_H = ' ▁▂▃▄▅▆▇█'
 
@@ -19,3 +24,100 @@ def gauge(score, width):
 
 def colorize(fg, bg, glyph):
     return f'\x1b[38;2;{fg[0]};{fg[1]};{fg[2]};48;2;{bg[0]};{bg[1]};{bg[2]}m{glyph}\x1b[0m'
+
+SGR_RESET = '\x1b[0m'
+
+COLOR_MODES = ['truecolor', '256', '16']
+
+@functools.lru_cache(maxsize=8)
+def _sgr_codes(palette, mode):
+    if mode == 'truecolor':
+        return [f'\x1b[38;2;{fg[0]};{fg[1]};{fg[2]}m' for fg in palette]
+    if mode == '256':
+        # leave out the 16 system colors, their RGB values depend on the terminal's theme
+        return [f'\x1b[38;5;{16 + idx}m' for idx in nearest_colors(palette, xterm_256()[16:])]
+    elif mode == '16':
+        return [f'\x1b[{30 + idx if idx < 8 else 90 + idx - 8}m' for idx in nearest_colors(palette, XTERM_16)]
+    raise ValueError(f'Unknown color mode {mode}')
+
+def sgr_codes(palette, mode='truecolor'):
+    '''
+    SGR sequences to set the foreground to each color of `palette`, in one of COLOR_MODES.
+    For '256' and '16', every color is mapped to the perceptually nearest xterm color.
+    '''
+    return _sgr_codes(tuple(tuple(fg) for fg in palette), mode)
+
+class BufferedWriter(abc.ABC):
+    '''
+    Base class for writers of colored text, see AnsiWriter. Subclasses implement render_line.
+    Writes encoded output to the binary stream `out` in chunks of about `chunk_size` characters.
+    If `line_buffered` is set, flush after every line (for interactive use).
+    '''
+    def __init__(self, out, chunk_size=65536, line_buffered=False, encoding='utf-8', errors='strict'):
+        self.out = out
+        self.chunk_size = chunk_size
+        self.line_buffered = line_buffered
+        self.encoding = encoding
+        self.errors = errors
+        self.buf = []
+        self.size = 0
+        self.bytes_written = 0
+
+    @abc.abstractmethod
+    def render_line(self, spans):
+        '''Return a line of (color index, text) spans as output text, including the newline.'''
+
+    def write(self, s):
+        '''Write raw text.'''
+        self.buf.append(s)
+        self.size += len(s)
+        if self.line_buffered or self.size >= self.chunk_size:
+            self.flush()
+
+    def write_line(self, spans):
+        '''Write a line of (color index, text) spans, color index None meaning uncolored.'''
+        self.write(self.render_line(spans))
+
+    def flush(self):
+        data = ''.join(self.buf).encode(self.encoding, self.errors)
+        self.out.write(data)
+        self.bytes_written += len(data)
+        self.out.flush()
+        self.buf = []
+        self.size = 0
+
+    def close(self):
+        '''Finish the output. Doesn't close `out`.'''
+        self.flush()
+
+class AnsiWriter(BufferedWriter):
+    '''
+    Writer for colored text to a terminal. Only emits an SGR sequence when the foreground color changes.
+    `palette` maps color indices to RGB, `colors` is the color mode (see sgr_codes).
+    '''
+    def __init__(self, out, palette, chunk_size=65536, line_buffered=False, encoding='utf-8', errors='strict', colors='truecolor'):
+        super().__init__(out, chunk_size, line_buffered, encoding, errors)
+        self.codes = sgr_codes(palette, colors)
+
+    def render_line(self, spans):
+        s = []
+        cur = None
+        for color, text in spans:
+            if not text:
+                continue
+            # compare codes, not color indices: with fewer colors, neighbouring indices often share one
+            code = None if color is None else self.codes[color]
+            if code != cur:
+                if code is None:
+                    if text.isspace(): # no background, so the foreground color doesn't matter
+                        s.append(text)
+                        continue
+                    s.append(SGR_RESET)
+                else:
+                    s.append(code)
+                cur = code
+            s.append(text)
+        if cur is not None:
+            s.append(SGR_RESET)
+        s.append('\n')
+        return ''.join(s)
@@ -0,0 +1,31 @@
+# SPDX-License-Identifier: MIT
+'''
+Token database: CLIP embeddings of the entries of the CLIP tokenizer vocabulary, to color words
+that aren't in the word database token by token.
+
+It is a word database keyed by vocabulary entry (`token-embeddings.db`, with ranking table and
+compact store like the word database), plus the tokenizer's merges (`token-embeddings.merges`)
+for splitting words into tokens with impl/bpe.py. Use neurocat_build_tokendb.py to create it.
+'''
+import pathlib
+
+from . import bpe
+from . import resource
+from .word_db import WordDB
+
+def default_path():
+    return resource.filename('token-embeddings.db')
+
+def merges_path(db_path):
+    '''Location of the merges file belonging to a token database.'''
+    return pathlib.Path(db_path).with_suffix('.merges')
+
+class TokenDB:
+    '''
+    Read-only token database. `bpe` splits words into tokens, `wdb` (a read-only WordDB) has
+    their embeddings and color rankings.
+    '''
+    def __init__(self, path=None, cache_size=65536):
+        path = path or default_path()
+        self.bpe = bpe.BPE(bpe.read_merges(merges_path(path)), cache_size)
+        self.wdb = WordDB(path, readonly=True)
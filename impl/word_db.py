@@ -1,26 +1,62 @@
 # SPDX-License-Identifier: MIT
+import contextlib
+import pathlib
 import sqlite3
 
-import numpy as np
-
 from . import resource
+from . import word_store
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
 
 class WordDB:
     '''
     Word embeddings database.
+    If `readonly` is set and an up-to-date compact store exists next to the database
+    (see neurocat_export_worddb.py), lookups are served from that instead. Otherwise the
+    database is opened read-only and immutable, so it must not be modified while in use; long-running
+    processes reopen it when it changes (see neurocat_server.py).
+    A WordDB must not be used from several threads at the same time.
     '''
-    def __init__(self, path=None):
+    def __init__(self, path=None, readonly=False):
         if path is None:
             path = resource.filename('word-embeddings.db')
+        self.store = None
+        self._itemsize = None # of ranking indices, looked up on first use
+        if readonly:
+            store_path = word_store.store_path(path)
+            if word_store.is_fresh(store_path, path):
+                self.store = word_store.WordStore(store_path)
+                self.con = None
+                self.tables = set() # reads are served by the store, nothing can be written
+                return
+        if readonly:
+            # read-only and immutable: no locking or journal checks, and nothing is created
+            if not pathlib.Path(path).exists():
+                raise FileNotFoundError(f'{path}: word database not found')
+            # may be used from another thread than it was opened in, see impl/api.py
+            self.con = sqlite3.connect(pathlib.Path(path).absolute().as_uri() + '?mode=ro&immutable=1', uri=True, check_same_thread=False)
+            cur = self.con.cursor()
+            cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            self.tables = {row[0] for row in cur}
+            self._lookup_cur = self.con.cursor()
+            return
         self.con = sqlite3.connect(path)
 
         cur = self.con.cursor()
-        try:
-            cur.execute("CREATE TABLE embeddings(id INTEGER PRIMARY KEY, word TEXT NOT NULL, embedding BLOB NOT NULL, UNIQUE(word))")
-        except sqlite3.OperationalError:
-            pass # already exists
-        else:
-            self.con.commit()
+        for schema in [
+            "CREATE TABLE embeddings(id INTEGER PRIMARY KEY, word TEXT NOT NULL, embedding BLOB NOT NULL, UNIQUE(word))",
+            # per-word color ranking (color indices, best first), see set_rankings
+            "CREATE TABLE rankings(word TEXT PRIMARY KEY, ranking BLOB NOT NULL, colorfulness REAL NOT NULL)",
+            "CREATE TABLE meta(key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        ]:
+            try:
+                cur.execute(schema)
+            except sqlite3.OperationalError:
+                pass # already exists
+        self.con.commit()
+        self.tables = {'embeddings', 'rankings', 'meta'}
+        self._lookup_cur = self.con.cursor() # reused by the per-word lookups
 
     def insert(self, word, embedding):
         key = word.lower()
@@ -29,13 +65,254 @@ class WordDB:
         cur.execute("INSERT INTO embeddings (word, embedding) VALUES (?, ?)", [key, data])
         self.con.commit()
 
+    def insert_many(self, items):
+        '''Insert (word, embedding) pairs in a single transaction.'''
+        cur = self.con.cursor()
+        cur.executemany("INSERT INTO embeddings (word, embedding) VALUES (?, ?)",
+            ((word.lower(), embedding.astype(np.float16).tobytes()) for word, embedding in items))
+        self.con.commit()
+
+    @contextlib.contextmanager
+    def _bulk(self):
+        '''
+        Cursor for a large write, in a single transaction with write-ahead logging. Afterwards the
+        log is checkpointed and the database switched back to a rollback journal, as immutable
+        readers (see readonly) don't look at the log.
+        '''
+        self.con.commit()
+        cur = self.con.cursor()
+        cur.execute('PRAGMA main.journal_mode=WAL')
+        try:
+            yield cur
+            self.con.commit()
+        except BaseException:
+            self.con.rollback()
+            raise
+        finally:
+            cur.execute('PRAGMA main.wal_checkpoint(TRUNCATE)')
+            cur.execute('PRAGMA main.journal_mode=DELETE')
+
+    def add_many(self, rows):
+        '''
+        Insert (word, embedding) rows with the embedding as float16 bytes, skipping words that are
+        already present, in a single transaction. Returns the number of words added.
+        '''
+        with self._bulk() as cur:
+            before = self.con.total_changes
+            cur.executemany('INSERT OR IGNORE INTO embeddings (word, embedding) VALUES (?, ?)',
+                ((word.lower(), embedding) for word, embedding in rows))
+            return self.con.total_changes - before
+
+    def merge(self, path):
+        '''
+        Add the words of the word database at `path` that aren't in this one, in a single statement.
+        Raises ValueError if its embeddings have another dimension or come from another model.
+        Returns the number of words added.
+        '''
+        if not pathlib.Path(path).exists():
+            raise FileNotFoundError(f'{path}: word database not found')
+        self.con.commit()
+        cur = self.con.cursor()
+        cur.execute('ATTACH DATABASE ? AS other', [str(path)])
+        try:
+            cur.execute("SELECT name FROM other.sqlite_master WHERE type='table'")
+            tables = {row[0] for row in cur}
+            if 'embeddings' not in tables:
+                raise ValueError(f'{path}: not a word database')
+            model = None
+            if 'meta' in tables:
+                cur.execute("SELECT value FROM other.meta WHERE key='model'")
+                model = (cur.fetchone() or [None])[0]
+            cur.execute('SELECT DISTINCT LENGTH(embedding) FROM other.embeddings')
+            sizes = {row[0] for row in cur}
+            self.check_dim(*(size // 2 for size in sizes))
+            self.set_model(model) # last, as it commits right away
+
+            with self._bulk() as bulk:
+                bulk.execute('INSERT OR IGNORE INTO embeddings (word, embedding) SELECT word, embedding FROM other.embeddings ORDER BY id')
+                return bulk.rowcount
+        finally:
+            cur.execute('DETACH DATABASE other')
+
+    def set_model(self, model):
+        '''
+        Record the name of the model the embeddings come from. Raises ValueError if the database
+        has embeddings of another model. Databases from before this was recorded are assumed to match.
+        '''
+        stored = self.get_meta('model')
+        if model is None or stored == model:
+            return
+        if stored is not None:
+            raise ValueError(f'Embeddings are from model {stored}, not {model}')
+        cur = self.con.cursor()
+        self._set_meta(cur, 'model', model)
+        self.con.commit()
+
+    def check_dim(self, *dims):
+        '''Raise ValueError unless all of `dims` match the embedding dimension of the (non-empty) database.'''
+        expected = {self.dim()} - {0}
+        if len(set(dims) | expected) > 1:
+            raise ValueError(f'Embedding dimensions {sorted(set(dims) | expected)} do not match')
+
     def lookup(self, word):
+        if self.store is not None:
+            return self.store.lookup(word)
         key = word.lower()
-        cur = self.con.cursor()
-        cur.execute('SELECT embedding FROM embeddings WHERE word=?', [key])
-        result = cur.fetchone()
+        result = self._lookup_cur.execute('SELECT embedding FROM embeddings WHERE word=?', [key]).fetchone()
         if result is not None:
             return np.frombuffer(result[0], dtype=np.float16).astype(np.float32)
         else:
             return None
 
+    def lookup_many(self, words, chunk_size=500):
+        '''
+        Look up many words at once, in a query per `chunk_size` distinct words.
+        Returns (embeddings, found): a float32 matrix with a row for every word (zero if
+        the word is unknown), and a boolean array that is set for the words that were found.
+        '''
+        if self.store is not None:
+            return self.store.lookup_many(words)
+        keys = [word.lower() for word in words]
+        distinct = list(set(keys))
+        rows = {}
+        cur = self.con.cursor()
+        for start in range(0, len(distinct), chunk_size): # stay below SQLITE_MAX_VARIABLE_NUMBER
+            chunk = distinct[start:start + chunk_size]
+            cur.execute(f'SELECT word, embedding FROM embeddings WHERE word IN ({",".join("?" * len(chunk))})', chunk)
+            rows.update(cur.fetchall())
+        found = np.array([key in rows for key in keys], dtype=bool)
+        m = np.zeros((len(keys), self.dim()), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if found[i]:
+                m[i] = np.frombuffer(rows[key], dtype=np.float16)
+        return m, found
+
+    def dim(self):
+        '''Embedding dimension, 0 if the database is empty.'''
+        if self.store is not None:
+            return self.store.meta['dim']
+        cur = self.con.cursor()
+        cur.execute('SELECT LENGTH(embedding) FROM embeddings LIMIT 1')
+        result = cur.fetchone()
+        return result[0] // 2 if result is not None else 0
+
+    def embeddings(self, chunk_size=4096, sort=False):
+        '''
+        Iterate over all (words, embeddings) in chunks, embeddings as a float32 matrix.
+        If `sort` is set, iterate in order of the UTF-8 encoded word.
+        '''
+        if self.store is not None:
+            yield from self.store.embeddings_chunks(chunk_size)
+            return
+        cur = self.con.cursor()
+        cur.execute(f'SELECT word, embedding FROM embeddings ORDER BY {"word" if sort else "id"}')
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            words = [row[0] for row in rows]
+            m = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float16)
+            yield words, m.reshape(len(rows), -1).astype(np.float32)
+
+    def words(self):
+        '''Return the set of all words in the database.'''
+        if self.store is not None:
+            return {word.decode() for word in self.store.words}
+        cur = self.con.cursor()
+        cur.execute('SELECT word FROM embeddings')
+        return {row[0] for row in cur}
+
+    def count(self):
+        if self.store is not None:
+            return len(self.store)
+        cur = self.con.cursor()
+        cur.execute('SELECT COUNT(*) FROM embeddings')
+        return cur.fetchone()[0]
+
+    def max_word_length(self, encoded=False):
+        '''Length of the longest word in characters, or in bytes if `encoded` is set.'''
+        if self.store is not None:
+            return max((len(word if encoded else word.decode()) for word in self.store.words), default=0)
+        cur = self.con.cursor()
+        if encoded:
+            cur.execute('SELECT MAX(LENGTH(CAST(word AS BLOB))) FROM embeddings')
+        else:
+            cur.execute('SELECT MAX(LENGTH(word)) FROM embeddings')
+        return cur.fetchone()[0] or 0
+
+    def get_meta(self, key):
+        if self.store is not None: # only knows model and rankings_fingerprint
+            return self.store.meta.get(key)
+        if 'meta' not in self.tables: # database from before the table existed, opened read-only
+            return None
+        cur = self.con.cursor()
+        cur.execute('SELECT value FROM meta WHERE key=?', [key])
+        result = cur.fetchone()
+        return result[0] if result is not None else None
+
+    def _set_meta(self, cur, key, value):
+        cur.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', [key, value])
+
+    def _embeddings_version(self):
+        # rowids only grow, so this changes whenever words are added
+        cur = self.con.cursor()
+        cur.execute('SELECT MAX(id) FROM embeddings')
+        return str(cur.fetchone()[0])
+
+    def set_rankings(self, rows, fingerprint, itemsize=1):
+        '''
+        Replace the color ranking table. `rows` is an iterable of (word, ranking, colorfulness),
+        where ranking is a sequence of color indices, most strongly associated first.
+        `fingerprint` identifies the color table the rankings were computed against.
+        Indices are stored as little-endian integers of `itemsize` bytes, see word_store.ranking_itemsize.
+        '''
+        cur = self.con.cursor()
+        cur.execute('DELETE FROM rankings')
+        cur.executemany('INSERT INTO rankings (word, ranking, colorfulness) VALUES (?, ?, ?)',
+            ((word, np.asarray(ranking, dtype=f'<u{itemsize}').tobytes(), float(colorfulness)) for word, ranking, colorfulness in rows))
+        self._set_meta(cur, 'rankings_fingerprint', fingerprint)
+        self._set_meta(cur, 'rankings_itemsize', str(itemsize))
+        self._itemsize = None
+        self._set_meta(cur, 'rankings_version', self._embeddings_version())
+        self.con.commit()
+
+    def rankings_status(self, fingerprint):
+        '''Return 'ok' if the ranking table is present and matches, 'stale' if outdated, None if absent.'''
+        if self.store is not None:
+            return self.store.rankings_status(fingerprint)
+        stored = self.get_meta('rankings_fingerprint')
+        if stored is None:
+            return None
+        if stored != fingerprint or self.get_meta('rankings_version') != self._embeddings_version():
+            return 'stale'
+        return 'ok'
+
+    def _rankings_itemsize(self):
+        return int(self.get_meta('rankings_itemsize') or 1)
+
+    def lookup_ranking(self, word):
+        '''Return (ranking, colorfulness) for a word, ranking as a sequence of color indices, or None.'''
+        if self.store is not None:
+            return self.store.lookup_ranking(word)
+        key = word.lower()
+        result = self._lookup_cur.execute('SELECT ranking, colorfulness FROM rankings WHERE word=?', [key]).fetchone()
+        if result is None:
+            return None
+        if self._itemsize is None:
+            self._itemsize = self._rankings_itemsize()
+        return word_store.ranking_indices(result[0], self._itemsize), result[1]
+
+    def rankings(self, chunk_size=4096):
+        '''Iterate over the ranking table in (rankings, colorfulness) chunks, in the order of embeddings(sort=True).'''
+        if self.store is not None:
+            yield from self.store.rankings_chunks(chunk_size)
+            return
+        itemsize = self._rankings_itemsize()
+        cur = self.con.cursor()
+        cur.execute('SELECT ranking, colorfulness FROM embeddings JOIN rankings USING (word) ORDER BY word')
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            m = np.frombuffer(b''.join(row[0] for row in rows), dtype=f'<u{itemsize}')
+            yield m.reshape(len(rows), -1), np.array([row[1] for row in rows], dtype=np.float32)
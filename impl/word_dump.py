@@ -0,0 +1,96 @@
+# SPDX-License-Identifier: MIT
+'''
+Exchange format for word databases, to combine embeddings computed on several hosts. Unlike
+the compact store (see word_store.py), a dump can be loaded back into a word database.
+
+A dump is an .npz archive (which numpy.load can read as well) containing:
+- `words.npy`: the words (fixed-width UTF-8 bytes)
+- `embeddings.npy`: float16 embedding matrix, one row per word
+- `model.npy`: name of the model the embeddings come from, empty if unknown
+
+Both are written and read in chunks, so memory use doesn't depend on the size of the database.
+'''
+import shutil
+import tempfile
+import zipfile
+
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+def _write_header(f, dtype, shape):
+    np.lib.format.write_array_header_2_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': shape})
+
+def _read_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        raise ValueError(f'Unsupported .npy format version {version}')
+    if fortran_order:
+        raise ValueError('Fortran-ordered arrays are not supported')
+    return shape, dtype
+
+def dump(wdb, path, chunk_size=4096):
+    '''Write all words and embeddings of `wdb` to `path`. Returns the number of words written.'''
+    count = wdb.count()
+    dim = wdb.dim()
+    words_dtype = np.dtype(f'S{max(wdb.max_word_length(encoded=True), 1)}')
+    written = 0
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        with zf.open('model.npy', 'w') as f:
+            np.lib.format.write_array(f, np.array(wdb.get_meta('model') or ''), allow_pickle=False)
+        # one member can be written at a time, so spool the words while writing the embeddings
+        with tempfile.TemporaryFile() as words:
+            with zf.open('embeddings.npy', 'w', force_zip64=True) as f:
+                _write_header(f, np.float16, (count, dim))
+                for chunk_words, m in wdb.embeddings(chunk_size):
+                    f.write(m.astype(np.float16).tobytes())
+                    words.write(np.array([word.encode() for word in chunk_words], dtype=words_dtype).tobytes())
+                    written += len(chunk_words)
+            if written != count:
+                raise ValueError('Database changed while dumping')
+            words.seek(0)
+            with zf.open('words.npy', 'w', force_zip64=True) as f:
+                _write_header(f, words_dtype, (count,))
+                shutil.copyfileobj(words, f)
+    return written
+
+class Reader:
+    '''Reads a dump made with dump(). `model` is None if unknown.'''
+    def __init__(self, path):
+        self.zf = zipfile.ZipFile(path, 'r')
+        missing = {'model.npy', 'words.npy', 'embeddings.npy'} - set(self.zf.namelist())
+        if missing:
+            self.zf.close()
+            raise ValueError(f'{path}: not a word dump, missing {", ".join(sorted(missing))}')
+        with self.zf.open('model.npy') as f:
+            self.model = str(np.lib.format.read_array(f, allow_pickle=False)) or None
+        with self.zf.open('embeddings.npy') as f:
+            (self.count, self.dim), dtype = _read_header(f)
+        if dtype != np.float16:
+            raise ValueError(f'{path}: embeddings must be float16, not {dtype}')
+
+    def chunks(self, chunk_size=4096):
+        '''Iterate over (words, embeddings) chunks, embeddings as float16 matrix.'''
+        with self.zf.open('words.npy') as wf, self.zf.open('embeddings.npy') as ef:
+            (count,), words_dtype = _read_header(wf)
+            _read_header(ef)
+            if count != self.count:
+                raise ValueError('Number of words and embeddings differ')
+            for start in range(0, count, chunk_size):
+                n = min(chunk_size, count - start)
+                words = np.frombuffer(wf.read(n * words_dtype.itemsize), dtype=words_dtype)
+                m = np.frombuffer(ef.read(n * self.dim * 2), dtype=np.float16).reshape(n, self.dim)
+                yield [word.decode() for word in words], m
+
+    def close(self):
+        self.zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
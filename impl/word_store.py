@@ -0,0 +1,316 @@
+# SPDX-License-Identifier: MIT
+'''
+Compact read-only word embeddings store.
+
+A store is a directory containing:
+- `words.npy`: sorted UTF-8 encoded words (fixed-width bytes)
+- `embeddings.npy`: float16 embedding matrix, one row per word; or in the quantized formats
+  (see impl/quantize.py), int8 with per-row `scales.npy`, or product-quantized `codes.npy`
+  with `codebook.npy`
+- `rankings.npy`, `colorfulness.npy` (optional): color ranking table, see neurocat_build_rankings.py
+- `meta.json`: format version, embedding format, model name and ranking table fingerprint
+
+All files are memory-mapped, so opening is instant and pages are shared between processes.
+Use neurocat_export_worddb.py to create one from a word database.
+'''
+import array
+import functools
+import json
+import mmap
+import pathlib
+import re
+import struct
+import sys
+
+from . import quantize
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+VERSION = 1
+FORMATS = ['float16', 'int8', 'pq']
+FILES = ['meta.json', 'words.npy', 'embeddings.npy', 'scales.npy', 'codes.npy', 'codebook.npy', 'rankings.npy', 'colorfulness.npy']
+
+def ranking_itemsize(num_colors):
+    '''Bytes per color index in a ranking table for a palette of `num_colors`.'''
+    return 1 if num_colors <= 256 else 2
+
+def ranking_indices(data, itemsize):
+    '''Sequence of color indices from a ranking stored as bytes of little-endian integers.'''
+    if itemsize == 1:
+        return data
+    indices = array.array('H', data)
+    if sys.byteorder != 'little':
+        indices.byteswap()
+    return indices
+
+def store_path(db_path):
+    '''Default store location for a sqlite word database.'''
+    db_path = pathlib.Path(db_path)
+    return db_path.with_suffix('.store')
+
+def is_fresh(path, db_path):
+    '''Return True if there is a store at `path` that is not older than the database.'''
+    try:
+        mtime = (pathlib.Path(path) / 'meta.json').stat().st_mtime
+    except FileNotFoundError:
+        return False
+    try:
+        return mtime >= pathlib.Path(db_path).stat().st_mtime
+    except FileNotFoundError:
+        return True
+
+def remove(path):
+    '''
+    Remove the store at `path`, if any. Only the files of a store are removed; raises ValueError if
+    `path` is something else, such as a directory with other files in it.
+    '''
+    path = pathlib.Path(path)
+    if not path.exists():
+        return
+    if not path.is_dir():
+        raise ValueError(f'{path}: not a word store')
+    others = sorted(entry.name for entry in path.iterdir() if entry.name not in FILES)
+    if others:
+        raise ValueError(f'{path}: not a word store, contains {", ".join(others[:3])}{", ..." if len(others) > 3 else ""}')
+    for name in FILES:
+        (path / name).unlink(missing_ok=True)
+    path.rmdir()
+
+class _Records:
+    '''
+    The rows of a .npy file as bytes, memory-mapped without numpy, so that the lookups for rendering
+    from the ranking table don't need to import it.
+    '''
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:6] != b'\x93NUMPY':
+            raise ValueError(f'{filename}: not a .npy file')
+        if self.mm[6] == 1:
+            header_len, = struct.unpack_from('<H', self.mm, 8)
+            self.offset = 10 + header_len
+        else:
+            header_len, = struct.unpack_from('<I', self.mm, 8)
+            self.offset = 12 + header_len
+        header = self.mm[self.offset - header_len:self.offset].decode('latin-1')
+        self.itemsize = int(re.search(r"'descr':\s*'[<>|=]?[a-zA-Z](\d+)'", header).group(1))
+        shape = [int(dim) for dim in re.search(r"'shape':\s*\(([^)]*)\)", header).group(1).split(',') if dim.strip()]
+        self.count = shape[0]
+        self.size = self.itemsize
+        for dim in shape[1:]:
+            self.size *= dim
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        start = self.offset + idx * self.size
+        return self.mm[start:start + self.size]
+
+    def find(self, key):
+        '''
+        Index of the row equal to `key` in sorted records, or None. Binary search on the mapping
+        itself, so that nothing is loaded up front and the pages stay shared between processes.
+        '''
+        mm, offset, size = self.mm, self.offset, self.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = offset + mid * size
+            if mm[start:start + size] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = offset + lo * size
+        if lo < self.count and mm[start:start + size] == key:
+            return lo
+        return None
+
+class WordStore:
+    '''
+    Memory-mapped word embeddings store.
+    '''
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        with open(self.path / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != VERSION:
+            raise ValueError(f'{self.path}: unsupported word store version {self.meta.get("version")}')
+        self.format = self.meta.get('format', 'float16')
+        if self.format not in FORMATS:
+            raise ValueError(f'{self.path}: unsupported embedding format {self.format}')
+
+        # word and ranking lookups work on the raw files; the numpy arrays below are opened on first use
+        self._words = _Records(self.path / 'words.npy')
+        if self.meta.get('rankings_fingerprint') is not None:
+            self._rankings = _Records(self.path / 'rankings.npy')
+            self._colorfulness = _Records(self.path / 'colorfulness.npy')
+        else:
+            self._rankings = None
+
+    def _load(self, name, mmap_mode='r'):
+        # plain ndarray views of the mapping, indexing a memmap is a lot slower
+        return np.asarray(np.load(self.path / name, mmap_mode=mmap_mode))
+
+    @functools.cached_property
+    def words(self):
+        return self._load('words.npy')
+
+    @functools.cached_property
+    def embeddings(self):
+        return self._load('embeddings.npy')
+
+    @functools.cached_property
+    def scales(self):
+        return self._load('scales.npy')
+
+    @functools.cached_property
+    def codes(self):
+        return self._load('codes.npy')
+
+    @functools.cached_property
+    def codebook(self):
+        return self._load('codebook.npy', mmap_mode=None)
+
+    def __len__(self):
+        return len(self._words)
+
+    def index(self, word):
+        '''Return row index of a word, or None.'''
+        key = word.lower().encode()
+        if len(key) > self._words.size:
+            return None
+        return self._words.find(key.ljust(self._words.size, b'\0')) # padded as stored
+
+    def _decode(self, rows):
+        '''Embeddings of rows (a slice or index array) as float32 matrix.'''
+        if self.format == 'int8':
+            return quantize.dequantize_int8(self.embeddings[rows], self.scales[rows])
+        elif self.format == 'pq':
+            return quantize.decode_pq(self.codes[rows], self.codebook)
+        return self.embeddings[rows].astype(np.float32)
+
+    def lookup(self, word):
+        idx = self.index(word)
+        if idx is None:
+            return None
+        if self.format == 'float16':
+            return self.embeddings[idx].astype(np.float32)
+        return self._decode(slice(idx, idx + 1))[0]
+
+    def lookup_many(self, words):
+        '''See WordDB.lookup_many.'''
+        keys = [word.lower().encode() for word in words]
+        found = np.array([len(key) <= self.words.itemsize for key in keys], dtype=bool)
+        keys = np.array(keys, dtype=self.words.dtype) # truncates over-long keys, but those are masked out already
+        idx = np.minimum(np.searchsorted(self.words, keys), len(self.words) - 1)
+        found &= self.words[idx] == keys
+        m = np.zeros((len(keys), self.meta['dim']), dtype=np.float32)
+        if found.any():
+            m[found] = self._decode(idx[found])
+        return m, found
+
+    def lookup_ranking(self, word):
+        if self._rankings is None:
+            return None
+        idx = self.index(word)
+        if idx is not None:
+            ranking = ranking_indices(self._rankings[idx], self._rankings.itemsize)
+            return ranking, struct.unpack('<f', self._colorfulness[idx])[0]
+        else:
+            return None
+
+    def rankings_status(self, fingerprint):
+        stored = self.meta.get('rankings_fingerprint')
+        if stored is None:
+            return None
+        return 'ok' if stored == fingerprint else 'stale'
+
+    def rankings_chunks(self, chunk_size=4096):
+        '''Iterate over the ranking table in (rankings, colorfulness) chunks, in word order.'''
+        rankings = self._load('rankings.npy')
+        colorfulness = self._load('colorfulness.npy')
+        for start in range(0, len(rankings), chunk_size):
+            yield rankings[start:start + chunk_size], colorfulness[start:start + chunk_size]
+
+    def embeddings_chunks(self, chunk_size=4096):
+        for start in range(0, len(self.words), chunk_size):
+            words = [w.decode() for w in self.words[start:start + chunk_size]]
+            yield words, self._decode(slice(start, start + chunk_size))
+
+    def scores_chunks(self, cas, chunk_size=4096):
+        '''
+        Iterate over (words, scores, ac_scores) chunks for all words against the colors of `cas`,
+        scoring quantized embeddings directly without decoding them first.
+        '''
+        scorer = quantize.PQScorer(self.codebook, cas) if self.format == 'pq' else None
+        for start in range(0, len(self.words), chunk_size):
+            stop = start + chunk_size
+            words = [w.decode() for w in self.words[start:stop]]
+            if self.format == 'int8':
+                scores, ac_scores = quantize.int8_compute_scores_batch(cas, self.embeddings[start:stop], self.scales[start:stop])
+            elif self.format == 'pq':
+                scores, ac_scores = scorer.compute_scores_batch(self.codes[start:stop])
+            else:
+                scores, ac_scores = cas.compute_scores_batch(self.embeddings[start:stop].astype(np.float32))
+            yield words, scores, ac_scores
+
+def write(path, count, max_len, dim, embeddings, rankings=None, format='float16', codebook=None, model=None):
+    '''
+    Write a store. `embeddings` yields (words, matrix) chunks in sorted order, `rankings`
+    optionally yields (rankings, colorfulness) chunks in the same order, and is a pair
+    (fingerprint, iterable). `format` is one of FORMATS; 'pq' needs a `codebook` from
+    quantize.train_pq. `model` is the name of the model the embeddings come from, if known.
+    '''
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    (path / 'meta.json').unlink(missing_ok=True)
+    words = np.lib.format.open_memmap(path / 'words.npy', mode='w+', dtype=f'S{max(max_len, 1)}', shape=(count,))
+    if format == 'float16':
+        outputs = [np.lib.format.open_memmap(path / 'embeddings.npy', mode='w+', dtype=np.float16, shape=(count, dim))]
+        encode = lambda m: (m,)
+    elif format == 'int8':
+        outputs = [
+            np.lib.format.open_memmap(path / 'embeddings.npy', mode='w+', dtype=np.int8, shape=(count, dim)),
+            np.lib.format.open_memmap(path / 'scales.npy', mode='w+', dtype=np.float32, shape=(count,)),
+        ]
+        encode = quantize.quantize_int8
+    elif format == 'pq':
+        np.save(path / 'codebook.npy', codebook.astype(np.float32), allow_pickle=False)
+        outputs = [np.lib.format.open_memmap(path / 'codes.npy', mode='w+', dtype=np.uint8, shape=(count, len(codebook)))]
+        encode = lambda m: (quantize.encode_pq(m, codebook),)
+    else:
+        raise ValueError(f'Unsupported embedding format {format}')
+    pos = 0
+    for chunk_words, m in embeddings:
+        words[pos:pos + len(chunk_words)] = [w.encode() for w in chunk_words]
+        for out, data in zip(outputs, encode(m)):
+            out[pos:pos + len(chunk_words)] = data
+        pos += len(chunk_words)
+    assert pos == count
+    words.flush()
+    for out in outputs:
+        out.flush()
+
+    meta = {'version': VERSION, 'dim': dim, 'format': format, 'model': model, 'rankings_fingerprint': None}
+    if rankings is not None:
+        fingerprint, chunks = rankings
+        rank = None
+        pos = 0
+        for chunk_rankings, chunk_colorfulness in chunks:
+            if rank is None:
+                rank = np.lib.format.open_memmap(path / 'rankings.npy', mode='w+', dtype=chunk_rankings.dtype.newbyteorder('<'), shape=(count, chunk_rankings.shape[1]))
+                colorfulness = np.lib.format.open_memmap(path / 'colorfulness.npy', mode='w+', dtype=np.float32, shape=(count,))
+            rank[pos:pos + len(chunk_rankings)] = chunk_rankings
+            colorfulness[pos:pos + len(chunk_rankings)] = chunk_colorfulness
+            pos += len(chunk_rankings)
+        if rank is not None:
+            assert pos == count
+            rank.flush()
+            colorfulness.flush()
+            meta['rankings_fingerprint'] = fingerprint
+
+    # written last: marks the store as complete
+    with open(path / 'meta.json', 'w') as f:
+        json.dump(meta, f)
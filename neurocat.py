@@ -1,10 +1,21 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: MIT
 import argparse
+import collections
+import contextlib
+import io
+import itertools
+import os
 import sys
-import re
+import time
 
-from impl.fun_color import fun_color
+from impl import resource
+from impl.fun_color import Colorizer, WordCache, palette, read_word_list
+from impl.html_util import HtmlWriter, html_header, html_footer
+from impl.ngram_index import NgramIndex
+from impl.stats import Stats, profile
+from impl.term_util import AnsiWriter, COLOR_MODES
+from impl.token_db import TokenDB
 from impl.word_db import WordDB
 from impl.color_assoc import ColorAssoc
 
@@ -23,38 +34,303 @@ def parse_args():
         default=1,
         help='Multiple colors per word instead of onlye one color per word. Value is 0 or 1. Default is 1.',
     )
+    parser.add_argument(
+        "-o", "--output",
+        type=str,
+        default=None,
+        help="Write output to this file instead of standard output.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=['ansi', 'html'],
+        default='ansi',
+        help="Output format: ANSI escape sequences for the terminal (default), or an HTML document.",
+    )
+    parser.add_argument(
+        "--colors",
+        choices=COLOR_MODES,
+        default='truecolor',
+        help='Terminal color mode: 24-bit truecolor (default), or the nearest colors of the xterm 256 or 16 color palettes, for terminals and multiplexers without truecolor support. Only for --format ansi.',
+    )
+    parser.add_argument(
+        "--line-buffered",
+        action='store_true',
+        help='Flush output after every line, for interactive use in pipes.',
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=65536,
+        help='Number of colored words to keep in memory. Default is 65536.',
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help='Number of worker processes to color the input in. Default is 1.',
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1 << 20,
+        help='Approximate size in bytes of the pieces of input handed to each worker with --jobs. Default is 1 MiB.',
+    )
+    parser.add_argument(
+        "--min-colorfulness",
+        type=float,
+        default=None,
+        metavar='C',
+        help='Only color words whose colorfulness (how much their strongest color stands out, between 0 and 1) is at least C.',
+    )
+    parser.add_argument(
+        "--skip-common",
+        action='store_true',
+        help='Leave common words and words of three letters or less uncolored. Common words are those in data/common_words.txt and data/funcolor_ignored_words.txt, except those in data/funcolor_add_words.txt.',
+    )
+    parser.add_argument(
+        "--tokens",
+        action='store_true',
+        help='Color unknown words per CLIP token. Needs a token database, see neurocat_build_tokendb.py.',
+    )
+    parser.add_argument(
+        "--approximate",
+        action='store_true',
+        help='Color unknown words after the known words spelled most like them. Needs an n-gram index, see neurocat_build_ngrams.py.',
+    )
+    parser.add_argument(
+        "--stats",
+        action='store_true',
+        help='Print statistics about lookups and time spent per stage to standard error at exit.',
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar='FILE',
+        help='Run under cProfile and write the profile to FILE.',
+    )
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
+def make_colorizer(args, warn=True, stats=None):
     cas = ColorAssoc()
-    wdb = WordDB()
+    wdb = WordDB(readonly=True)
+
+    # render from the precomputed ranking table if it's up to date
+    rankings = wdb.rankings_status(cas.fingerprint)
+    if rankings == 'stale' and warn:
+        print('neurocat: color ranking table is out of date, run neurocat_build_rankings.py', file=sys.stderr)
+    ranked = rankings == 'ok'
+
+    common_words = None
+    if args.skip_common:
+        try:
+            common_words = read_word_list(resource.filename('common_words.txt'))
+        except FileNotFoundError:
+            common_words = frozenset()
+            if warn:
+                print('neurocat: no data/common_words.txt, only skipping short words', file=sys.stderr)
+        # optional local additions and exceptions
+        for name, add in (('funcolor_ignored_words.txt', True), ('funcolor_add_words.txt', False)):
+            try:
+                words = read_word_list(resource.filename(name))
+            except FileNotFoundError:
+                continue
+            common_words = common_words | words if add else common_words - words
+
+    tokens = None
+    if args.tokens:
+        try:
+            tokens = TokenDB()
+        except FileNotFoundError:
+            if warn:
+                print('neurocat: no token database, run neurocat_build_tokendb.py', file=sys.stderr)
+
+    approximate = None
+    if args.approximate:
+        try:
+            approximate = NgramIndex()
+        except FileNotFoundError:
+            if warn:
+                print('neurocat: no n-gram index, run neurocat_build_ngrams.py', file=sys.stderr)
+
+    return Colorizer(cas, wdb, fallback=True, multicolor=args.multicolor, min_colorfulness=args.min_colorfulness,
+        ranked=ranked, cache=WordCache(args.cache_size), common_words=common_words, stats=stats,
+        approximate=approximate, tokens=tokens)
+
+
+def make_writer(args, out, pal, encoding, errors, chunk_size=65536, line_buffered=False, standalone=True):
+    '''Writer for the output format. Without `standalone`, HTML output lacks the header and footer.'''
+    if args.format == 'html':
+        return HtmlWriter(out, pal, chunk_size=chunk_size, line_buffered=line_buffered, standalone=standalone)
+    return AnsiWriter(out, pal, chunk_size=chunk_size, line_buffered=line_buffered, encoding=encoding, errors=errors, colors=args.colors)
+
+
+def color_file(colorizer, f, writer, block_size=256):
+    '''
+    Color a text stream. Lines are processed in blocks of `block_size`, so that the words
+    of a whole block can be scored at once.
+    '''
+    if colorizer.stats is not None:
+        return _color_file_stats(colorizer, f, writer, block_size, colorizer.stats)
+    while lines := list(itertools.islice(f, block_size)):
+        lines = [line[0:-1] if line.endswith('\n') else line for line in lines]
+        colorizer.prepare(lines)
+        for line in lines:
+            writer.write_line(colorizer.line_spans(line))
+    writer.flush()
+
+def _color_file_stats(colorizer, f, writer, block_size, stats):
+    '''color_file, timing every stage.'''
+    clock = time.perf_counter
+    bytes_written = writer.bytes_written
+    while True:
+        start = clock()
+        lines = list(itertools.islice(f, block_size))
+        stats.count('bytes in', sum(len(line.encode()) for line in lines))
+        lines = [line[0:-1] if line.endswith('\n') else line for line in lines]
+        stats.add_time('read', clock() - start)
+        if not lines:
+            break
+        start = clock()
+        colorizer.prepare(lines)
+        stats.add_time('color: prepare', clock() - start)
+        for line in lines:
+            start = clock()
+            spans = colorizer.line_spans(line)
+            middle = clock()
+            writer.write_line(spans)
+            stats.add_time('color', middle - start)
+            stats.add_time('render', clock() - middle)
+    start = clock()
+    writer.flush()
+    stats.add_time('render', clock() - start)
+    stats.count('bytes out', writer.bytes_written - bytes_written)
+
+
+########### Multi-process mode
+
+_worker = None
+
+def _worker_init(args, encoding, errors):
+    global _worker
+    colorizer = make_colorizer(args, warn=False)
+    _worker = (colorizer, palette(colorizer.cas), encoding, errors, args, args.stats)
+
+def _worker_color_chunk(task):
+    '''
+    Color a chunk of lines, given as bytes or as (filename, offset, length).
+    Returns the encoded output, and statistics for the chunk if enabled.
+    '''
+    colorizer, pal, encoding, errors, args, stats = _worker
+    if stats:
+        colorizer.stats = Stats()
+    if isinstance(task, tuple):
+        filename, offset, length = task
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            task = f.read(length)
+    out = io.BytesIO()
+    writer = make_writer(args, out, pal, encoding, errors, chunk_size=sys.maxsize, standalone=False)
+    color_file(colorizer, io.TextIOWrapper(io.BytesIO(task)), writer)
+    return out.getvalue(), colorizer.stats.as_dict() if stats else None
 
-    filter_common = False
-    min_colorfulness = None
+def file_chunks(filename, chunk_size):
+    '''Split a file into line-aligned (filename, offset, length) chunks.'''
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        pos = 0
+        while pos < size:
+            f.seek(pos + chunk_size)
+            f.readline()
+            end = min(f.tell(), size)
+            yield (filename, pos, end - pos)
+            pos = end
 
-    common_words = set()
-    #with open('data/common_words.txt', 'r') as f:
-    #    common_words = set(w.lower() for w in f.read().splitlines())
-    #with open('data/funcolor_ignored_words.txt', 'r') as f:
-    #    common_words.update((w.lower() for w in f.read().splitlines()))
-    #with open('data/funcolor_add_words.txt', 'r') as f:
-    #    common_words.difference_update((w.lower() for w in f.read().splitlines()))
+def stream_chunks(f, chunk_size):
+    '''Read line-aligned chunks of bytes from a stream.'''
+    while lines := f.readlines(chunk_size):
+        yield b''.join(lines)
 
-    if args.filename != '-':
-        f = open(args.filename, 'r')
+def color_parallel(args, chunks, out, stats=None):
+    '''
+    Color chunks in a process pool, writing the results in order. At most two chunks per
+    worker are in flight, so memory use stays bounded when reading from a stream.
+    Statistics of the workers are added to `stats`.
+    '''
+    import multiprocessing # only needed here, and slow to import
+
+    def write_result(result):
+        data, chunk_stats = result.get()
+        out.write(data)
+        if stats is not None:
+            stats.merge(chunk_stats)
+
+    with multiprocessing.Pool(args.jobs, initializer=_worker_init, initargs=(args, *output_encoding(args))) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_worker_color_chunk, (chunk,)))
+            if len(pending) >= 2 * args.jobs:
+                write_result(pending.popleft())
+                if args.line_buffered:
+                    out.flush()
+        while pending:
+            write_result(pending.popleft())
+        out.flush()
+
+
+def output_encoding(args):
+    '''(encoding, errors) for the ANSI output.'''
+    if args.output:
+        return 'utf-8', 'strict'
+    return sys.stdout.encoding, sys.stdout.errors
+
+
+def run(args, stats):
+    with open(args.output, 'wb') if args.output else contextlib.nullcontext(sys.stdout.buffer) as out:
+        if args.jobs > 1:
+            # the workers don't warn, so that it happens only once
+            colorizer = make_colorizer(args)
+            if args.filename != '-':
+                chunks = file_chunks(args.filename, args.chunk_size)
+            else:
+                chunks = stream_chunks(sys.stdin.buffer, args.chunk_size)
+            if args.format == 'html':
+                out.write(html_header(palette(colorizer.cas)).encode())
+            color_parallel(args, chunks, out, stats)
+            if args.format == 'html':
+                out.write(html_footer().encode())
+            out.flush()
+            return None
+
+        colorizer = make_colorizer(args, stats=stats)
+
+        if args.filename != '-':
+            f = open(args.filename, 'r')
+        else:
+            f = sys.stdin
+
+        writer = make_writer(args, out, palette(colorizer.cas), *output_encoding(args), line_buffered=args.line_buffered)
+        with f:
+            color_file(colorizer, f, writer, block_size=1 if args.line_buffered else 256)
+        writer.close()
+        return colorizer
+
+
+def main():
+    args = parse_args()
+    stats = Stats() if args.stats else None
+
+    if args.profile:
+        colorizer = profile(lambda: run(args, stats), args.profile)
     else:
-        f = sys.stdin
-
-    with f:
-        for line in f:
-            line = line[0:-1]
-            words = re.split(r'(\W+)', line)
-            for idx in range(0, len(words), 2):
-                if not filter_common or (words[idx] not in common_words and len(words[idx]) > 3):
-                    words[idx] = fun_color(cas, wdb, words[idx], highlight_unknown=False, fallback=True, multicolor=args.multicolor, min_colorfulness=min_colorfulness)
-            print(''.join(words))
+        colorizer = run(args, stats)
+
+    if stats is not None:
+        extra = None
+        if colorizer is not None: # not available from worker processes
+            extra = {f'cache {name}': values for name, values in colorizer.cache.stats().items()}
+        stats.report(extra=extra)
 
 if __name__ == '__main__':
     main()
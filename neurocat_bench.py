@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Benchmark neurocat's hot paths.
+
+Runs against the real data files if they exist, otherwise (or with --synthetic) against a
+generated color table and word database, so that no CLIP model is needed. Results are written
+as JSON, to compare across commits with --compare.
+'''
+import argparse
+import json
+import os
+import pathlib
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from impl import resource
+
+SCRIPT_DIR = pathlib.Path(__file__).parent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark neurocat.")
+    parser.add_argument(
+        "--synthetic",
+        action='store_true',
+        help="Always use generated data, even if the real data files exist. Use this to compare results between machines.",
+    )
+    parser.add_argument(
+        "--words",
+        type=int,
+        default=50000,
+        help="Number of words in the synthetic word database. Default is 50000.",
+    )
+    parser.add_argument(
+        "--build-words",
+        type=int,
+        default=10000,
+        help="Number of words for the database build benchmark. Default is 10000.",
+    )
+    parser.add_argument(
+        "--large-words",
+        type=int,
+        default=400000,
+        help="Number of words in the store for the large-store startup benchmark. Default is 400000.",
+    )
+    parser.add_argument(
+        "--text-size",
+        type=int,
+        default=4,
+        help="Size of the generated text for the throughput benchmark, in MB. Default is 4.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Write results to this JSON file.",
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="Compare the results to an earlier JSON results file.",
+    )
+    parser.add_argument(
+        "--max-startup",
+        type=float,
+        default=None,
+        help="Exit with an error if the startup time of neurocat.py, with the data or with a large store, is more than this many seconds.",
+    )
+    return parser.parse_args()
+
+
+########### Data
+
+def random_word(rng):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 12)))
+
+def random_words(n, seed):
+    '''`n` distinct random words, sorted.'''
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < n:
+        words.add(random_word(rng))
+    return sorted(words)
+
+def synthetic_embeddings(v, n, rng):
+    '''`n` normalized embeddings close to random colors of `v`, so that the rankings are not uniform noise.'''
+    m = v[rng.integers(len(v), size=n)] * 0.3 + rng.normal(size=(n, v.shape[1])).astype(np.float32) * 0.03
+    m /= np.linalg.norm(m, axis=1, keepdims=True)
+    return m
+
+def make_synthetic_data(path, num_words, seed=1):
+    '''Generate a color table and a word database with rankings and compact store in `path`.'''
+    from impl.color_util import all_colors_rgb
+    from impl.word_db import WordDB
+    from impl.color_assoc import ColorAssoc
+    import neurocat_build_rankings
+    import neurocat_export_worddb
+
+    rng = np.random.default_rng(seed)
+    colors = all_colors_rgb()
+    v = rng.normal(size=(len(colors), 768)).astype(np.float32)
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    with open(path / 'colors.npy', 'wb') as f:
+        np.save(f, np.array(colors, dtype=np.uint8), allow_pickle=False)
+        np.save(f, v.astype(np.float16), allow_pickle=False)
+
+    words = random_words(num_words, seed)
+    m = synthetic_embeddings(v, len(words), rng)
+
+    wdb = WordDB(path / 'word-embeddings.db')
+    wdb.insert_many(zip(words, m))
+    neurocat_build_rankings.build(ColorAssoc(), wdb)
+    neurocat_export_worddb.export(wdb, path / 'word-embeddings.store')
+
+def make_text(path, words, size, seed=2):
+    '''Generate Zipf-distributed text of about `size` bytes, with some unknown words and plurals.'''
+    rng = random.Random(seed)
+    vocab = list(words)
+    rng.shuffle(vocab)
+    vocab += [random_word(rng) + 'q' for _ in range(len(vocab) // 20)] # unknown
+    vocab += [word + 's' for word in vocab[:len(vocab) // 20]] # plurals, known through fallback
+    weights = [1.0 / (rank + 1) ** 1.1 for rank in range(len(vocab))]
+    written = 0
+    with open(path, 'w') as f:
+        while written < size:
+            line = ' '.join(rng.choices(vocab, weights, k=rng.randint(3, 15)))
+            line += rng.choice(['', '.', ',', ':', ' -- x=3;']) + '\n'
+            f.write(line)
+            written += len(line)
+
+def sample_words(wdb, n, seed=3):
+    words = []
+    for chunk, _ in wdb.embeddings():
+        words += chunk
+        if len(words) >= n:
+            break
+    rng = random.Random(seed)
+    return [rng.choice(words) for _ in range(n)]
+
+
+########### Benchmarks
+
+def per_call(func, items, min_time=0.5):
+    '''Time func over items (repeating as needed), return microseconds per call.'''
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for item in items:
+            func(item)
+        calls += len(items)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls * 1e6
+
+def run_neurocat(args, input_path, env):
+    start = time.perf_counter()
+    with open(input_path, 'rb') as f:
+        subprocess.run([sys.executable, str(SCRIPT_DIR / 'neurocat.py'), *args], stdin=f, stdout=subprocess.DEVNULL, env=env, check=True)
+    return time.perf_counter() - start
+
+def bench_build(path, cas, num_words, batch_size=64, seed=4):
+    '''
+    Time building a word database of `num_words` in `path`: inserting in batches like
+    neurocat_build_worddb.py, ranking and exporting the store. The CLIP model is replaced by
+    random embeddings, so this measures everything but the model. Returns microseconds per word.
+    '''
+    from impl.word_db import WordDB
+    import neurocat_build_rankings
+    import neurocat_export_worddb
+
+    words = random_words(num_words, seed)
+    m = synthetic_embeddings(cas.v, num_words, np.random.default_rng(seed))
+    results = {}
+    start = time.perf_counter()
+    wdb = WordDB(path / 'build.db')
+    for pos in range(0, num_words, batch_size):
+        wdb.insert_many(zip(words[pos:pos + batch_size], m[pos:pos + batch_size]))
+    results['build_insert_per_word_us'] = (time.perf_counter() - start) / num_words * 1e6
+    start = time.perf_counter()
+    neurocat_build_rankings.build(cas, wdb)
+    results['build_rankings_per_word_us'] = (time.perf_counter() - start) / num_words * 1e6
+    start = time.perf_counter()
+    neurocat_export_worddb.export(wdb, path / 'build.store')
+    results['build_export_per_word_us'] = (time.perf_counter() - start) / num_words * 1e6
+    return results
+
+def make_large_store(path, data_path, cas, num_words, top=16, seed=5):
+    '''
+    Write a data directory with a store of `num_words` and the color table of `data_path` in `path`,
+    for the startup time with a large vocabulary. Rendering from the ranking table doesn't use the
+    embeddings, so they are left out (one dimension) and the rankings are random. Returns some words.
+    '''
+    from impl import word_store
+
+    shutil.copy(data_path / 'colors.npy', path / 'colors.npy')
+    words = random_words(num_words, seed)
+    rng = np.random.default_rng(seed)
+    dtype = f'<u{word_store.ranking_itemsize(len(cas.rgbs))}'
+    def rankings(chunk_size=65536):
+        for start in range(0, num_words, chunk_size):
+            n = min(chunk_size, num_words - start)
+            yield rng.integers(len(cas.rgbs), size=(n, top)).astype(dtype), rng.random(n, dtype=np.float32)
+    embeddings = ((words[start:start + 65536], np.zeros((len(words[start:start + 65536]), 1), dtype=np.float32))
+        for start in range(0, num_words, 65536))
+    word_store.write(word_store.store_path(path / 'word-embeddings.db'), num_words, max(len(w) for w in words), 1,
+        embeddings, (cas.fingerprint, rankings()))
+    return words[::num_words // 10][:10]
+
+def startup_time(line, env, tmp):
+    '''Median time of neurocat.py coloring one line.'''
+    line_path = tmp / 'line.txt'
+    with open(line_path, 'w') as f:
+        f.write(line + '\n')
+    run_neurocat([], line_path, env) # warm up page cache and color table cache
+    return statistics.median(run_neurocat([], line_path, env) for _ in range(7))
+
+def bench(data_path, text_size, build_words, large_words, tmp):
+    from impl.color_assoc import ColorAssoc
+    from impl.fun_color import fun_color
+    from impl.word_db import WordDB
+
+    results = {}
+    cas = ColorAssoc()
+    wdb_sql = WordDB(data_path / 'word-embeddings.db')
+    wdb_ro = WordDB(data_path / 'word-embeddings.db', readonly=True)
+
+    words = sample_words(wdb_sql, 2000)
+    unknown = [word + 'qq' for word in words[:200]]
+
+    results['lookup_sqlite_us'] = per_call(wdb_sql.lookup, words)
+    results['lookup_unknown_sqlite_us'] = per_call(wdb_sql.lookup, unknown)
+    if wdb_ro.store is not None:
+        results['lookup_store_us'] = per_call(wdb_ro.lookup, words)
+        results['lookup_unknown_store_us'] = per_call(wdb_ro.lookup, unknown)
+
+    embeddings = [wdb_sql.lookup(word) for word in words[:500]]
+    results['compute_scores_us'] = per_call(cas.compute_scores, embeddings)
+    batch = np.stack(embeddings)
+    results['rank_batch_per_word_us'] = per_call(lambda m: cas.rank_batch(m, 16), [batch]) / len(batch)
+
+    results.update(bench_build(tmp, cas, build_words))
+
+    ranked = wdb_ro.rankings_status(cas.fingerprint) == 'ok'
+    for multicolor in (True, False):
+        name = 'multicolor' if multicolor else 'singlecolor'
+        results[f'fun_color_{name}_us'] = per_call(
+            lambda word: fun_color(cas, wdb_sql, word, fallback=True, multicolor=multicolor), words[:500])
+        if ranked:
+            results[f'fun_color_{name}_ranked_us'] = per_call(
+                lambda word: fun_color(cas, wdb_ro, word, fallback=True, multicolor=multicolor, ranked=True), words[:500])
+
+    # whole program
+    env = dict(os.environ, NEUROCAT_DATA=str(data_path))
+    text_path = tmp / 'text.txt'
+    make_text(text_path, words, text_size * 1000000)
+    size = os.path.getsize(text_path) / 1e6
+    results['neurocat_multicolor_mb_s'] = size / run_neurocat([], text_path, env)
+    results['neurocat_singlecolor_mb_s'] = size / run_neurocat(['-m', '0'], text_path, env)
+
+    results['startup_s'] = startup_time(' '.join(words[:10]), env, tmp)
+
+    # startup must not depend on the size of the vocabulary
+    large_path = tmp / 'large'
+    large_path.mkdir()
+    large = make_large_store(large_path, data_path, cas, large_words)
+    results['startup_large_store_s'] = startup_time(' '.join(large), dict(os.environ, NEUROCAT_DATA=str(large_path)), tmp)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='neurocat-bench-') as tmp:
+        tmp = pathlib.Path(tmp)
+        data_path = resource.data_dir()
+        synthetic = args.synthetic or not (data_path / 'colors.npy').exists() or not (data_path / 'word-embeddings.db').exists()
+        if synthetic:
+            data_path = tmp / 'data'
+            data_path.mkdir()
+            print(f'Generating synthetic data ({args.words} words)', file=sys.stderr)
+            os.environ['NEUROCAT_DATA'] = str(data_path)
+            make_synthetic_data(data_path, args.words)
+
+        results = bench(data_path, args.text_size, args.build_words, args.large_words, tmp)
+
+    report = {
+        'revision': git_revision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'synthetic': synthetic,
+        'results': results,
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)['results']
+    for name, value in results.items():
+        line = f'{name:34} {value:12.3f}'
+        if previous is not None and previous.get(name):
+            # throughputs (MB/s) are better when higher, times when lower
+            ratio = value / previous[name]
+            better = ratio > 1 if name.endswith('_mb_s') else ratio < 1
+            verdict = 'same' if abs(ratio - 1) < 0.005 else 'better' if better else 'worse'
+            line += f'  ({ratio:.2f}x previous, {verdict})'
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.max_startup is not None:
+        startup = max(results['startup_s'], results['startup_large_store_s'])
+        if startup > args.max_startup:
+            print(f'Startup time {startup:.3f}s exceeds budget of {args.max_startup:.3f}s', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
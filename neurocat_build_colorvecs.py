@@ -4,33 +4,17 @@
 Generate array of solid color embeddings.
 '''
 import argparse
-import colorsys
-import pickle
+import os
 import sys
+import time
 
 import numpy as np
 from PIL import Image
 
 from impl import clip_model
-from impl.color_util import hex_to_rgb, rgb_to_hex, hsv_to_rgb8
+from impl.color_util import all_colors_rgb
 from impl import resource
 
-def all_colors_rgb():
-    # grey ramp
-    colors = []
-    for val in np.linspace(0.0, 1.0, 9):
-        colors.append(hsv_to_rgb8(0.0, 0.0, val))
-    # three brightness levels
-    for val in np.linspace(0.0, 1.0, 4)[1:]:
-        # three saturation levels
-        for sat in np.linspace(0.0, 1.0, 4)[1:]:
-            # 24 hues
-            for hue in np.linspace(0.0, 1.0, 25)[:-1]:
-                colors.append(hsv_to_rgb8(hue, sat, val))
-
-    return colors
-
-
 def parse_args():
     parser = argparse.ArgumentParser(description="Build neurocat color vectors.")
     parser.add_argument(
@@ -39,28 +23,81 @@ def parse_args():
         default="cuda",
         help="Pytorch device to use. Default is 'cuda'. Use 'cpu' to not use GPU acceleration (slow)."
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="Number of images to embed at once. Default is 32."
+    )
+    parser.add_argument(
+        "--hues",
+        type=int,
+        default=24,
+        help="Number of hues in the palette. Default is 24."
+    )
+    parser.add_argument(
+        "--levels",
+        type=int,
+        default=3,
+        help="Number of brightness and saturation levels per hue. Default is 3."
+    )
+    parser.add_argument(
+        "--greys",
+        type=int,
+        default=9,
+        help="Number of greys, from black to white. Default is 9."
+    )
     return parser.parse_args()
 
 
+def load_partial(path, colors):
+    '''Embeddings computed so far by an interrupted build of the same palette.'''
+    try:
+        with open(path, 'rb') as f:
+            done = np.load(f, allow_pickle=False)
+            embeddings = np.load(f, allow_pickle=False)
+    except (OSError, ValueError):
+        return []
+    if len(done) > len(colors) or not np.array_equal(done, np.array(colors[:len(done)], dtype=np.uint8)):
+        return []
+    return list(embeddings)
+
+
+def save(path, colors, embeddings):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, np.array(colors, dtype=np.uint8), allow_pickle=False)
+        np.save(f, np.array(embeddings).astype(np.float16), allow_pickle=False)
+    os.replace(tmp, path)
+
+
 def main():
     args = parse_args()
-    colors = all_colors_rgb()
+    colors = all_colors_rgb(args.hues, args.levels, args.greys)
+
+    # progress is saved after every batch, and picked up by running the same command again
+    partial = resource.filename('colors.partial.npy')
+    embeddings = load_partial(partial, colors)
+    if embeddings:
+        print(f'Resuming from color {len(embeddings)}', file=sys.stderr)
 
     m = clip_model.VisionModel(args.device)
 
     # make embeddings for solid-colored squares using vision model
-    embeddings = []
-    for color in colors:
-        image = Image.new('RGB', (224, 224), color=color)
-        emb = m.embedding_from_image(image)
-        embeddings.append(emb)
-
-    embeddings = np.array(embeddings)
+    start = time.perf_counter()
+    count = 0
+    for pos in range(len(embeddings), len(colors), args.batch_size):
+        batch = colors[pos:pos + args.batch_size]
+        images = [Image.new('RGB', (224, 224), color=color) for color in batch]
+        embeddings.extend(m.embeddings_from_images(images))
+        save(partial, colors[:len(embeddings)], embeddings)
+        count += len(batch)
+        elapsed = time.perf_counter() - start
+        print(f'{len(embeddings)}/{len(colors)} colors, {count / elapsed:.1f} colors/s', file=sys.stderr)
 
     # store generated embeddings
-    with resource.open('colors.npy', 'wb') as f:
-        np.save(f, np.array(colors, dtype=np.uint8), allow_pickle=False)
-        np.save(f, embeddings.astype(np.float16), allow_pickle=False)
+    save(resource.filename('colors.npy'), colors, embeddings)
+    partial.unlink(missing_ok=True)
 
 
 if __name__ == '__main__':
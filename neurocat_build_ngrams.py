@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Build a character n-gram index over the word database, used by `neurocat.py --approximate` to
+color unknown words after the known words that are spelled most like them.
+'''
+import argparse
+import collections
+import statistics
+import sys
+import time
+
+from impl import ngram_index
+from impl import resource
+from impl.fun_color import _lookup_fallback, _word_re
+from impl.word_db import WordDB
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build neurocat n-gram index for approximating unknown words.")
+    parser.add_argument(
+        "--db",
+        type=str,
+        default=None,
+        help="Word database to index. The default is data/word-embeddings.db.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Index directory to write. The default is data/word-embeddings.ngrams.",
+    )
+    parser.add_argument(
+        "-n",
+        type=int,
+        default=3,
+        help="Length of the character n-grams. Default is 3.",
+    )
+    parser.add_argument(
+        "--buckets",
+        type=int,
+        default=1 << 20,
+        help="Number of hash buckets for n-grams. Default is 1048576.",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        metavar='FILE',
+        help="After building, report how many of the unknown words in text FILE can be approximated, and how long that takes.",
+    )
+    return parser.parse_args()
+
+
+def report(index, wdb, filename, f=sys.stdout):
+    '''Print coverage gain and lookup latency for the words of a text file.'''
+    with open(filename, 'r', errors='replace') as text:
+        counts = collections.Counter(word for line in text for word in _word_re.split(line.rstrip('\n'))[::2] if word)
+    unknown = [word for word in counts if _lookup_fallback(wdb.lookup, word, True) is None]
+    latencies = []
+    approximated = []
+    for word in unknown:
+        start = time.perf_counter()
+        m = index.embedding(wdb, word)
+        latencies.append(time.perf_counter() - start)
+        if m is not None:
+            approximated.append(word)
+
+    total = sum(counts.values())
+    known = total - sum(counts[word] for word in unknown)
+    gained = sum(counts[word] for word in approximated)
+    print(f'words               {total} ({len(counts)} distinct)', file=f)
+    print(f'known               {known / total * 100.0:.1f}%', file=f)
+    print(f'known+approximated  {(known + gained) / total * 100.0:.1f}% ({len(approximated)} of {len(unknown)} distinct unknown words)', file=f)
+    if latencies:
+        latencies.sort()
+        print(f'lookup latency      median {statistics.median(latencies) * 1e6:.0f} us, '
+              f'p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f} us', file=f)
+
+
+def main():
+    args = parse_args()
+    wdb = WordDB(args.db or resource.filename('word-embeddings.db'))
+    output = args.output or ngram_index.default_path()
+
+    words = sorted(wdb.words())
+    if not words:
+        print('word database is empty', file=sys.stderr)
+        sys.exit(1)
+    ngram_index.build(output, words, args.n, args.buckets)
+    print(f'Indexed {len(words)} words in {output}', file=sys.stderr)
+
+    if args.report:
+        report(ngram_index.NgramIndex(output), wdb, args.report)
+
+
+if __name__ == '__main__':
+    main()
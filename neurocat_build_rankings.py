@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Precompute per-word color rankings, so that neurocat doesn't need to score embeddings at render time.
+'''
+import argparse
+
+from impl import word_store
+from impl.color_assoc import ColorAssoc
+from impl.word_db import WordDB
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build neurocat color ranking table.")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=None,
+        help="Number of colors to store per word. The default is enough to multicolor every word in the database, including plural fallbacks.",
+    )
+    return parser.parse_args()
+
+
+def rankings(cas, wdb, top):
+    dtype = f'<u{word_store.ranking_itemsize(len(cas.rgbs))}'
+    for words, m in wdb.embeddings():
+        _, indices, colorfulness = cas.rank_batch(m, top)
+        yield from zip(words, indices.astype(dtype), colorfulness)
+
+
+def build(cas, wdb, top=None):
+    if top is None:
+        top = wdb.max_word_length() + 2 # longest fallback suffix
+    top = min(top, len(cas.rgbs))
+
+    wdb.set_rankings(rankings(cas, wdb, top), cas.fingerprint, word_store.ranking_itemsize(len(cas.rgbs)))
+
+
+def main():
+    args = parse_args()
+    build(ColorAssoc(), WordDB(), args.top)
+
+
+if __name__ == '__main__':
+    main()
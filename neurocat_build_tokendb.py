@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Build the token database: CLIP embeddings for every entry of the CLIP tokenizer vocabulary, used
+by `neurocat.py --tokens` to color unknown words per token. This needs the CLIP model; coloring
+with the result doesn't.
+'''
+import argparse
+import itertools
+import sys
+import time
+
+from impl import bpe
+from impl import clip_model
+from impl import token_db
+from impl import word_store
+from impl.color_assoc import ColorAssoc
+from impl.word_db import WordDB
+import neurocat_build_rankings
+import neurocat_export_worddb
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build neurocat token database.")
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda",
+        help="Pytorch device to use. Default is 'cuda'. Use 'cpu' to not use GPU acceleration (slow)."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="Number of tokens to embed and insert at once. Default is 256."
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Token database to write. The default is data/token-embeddings.db.",
+    )
+    return parser.parse_args()
+
+
+def vocabulary(tokenizer):
+    '''(token, id) pairs of the vocabulary that can occur in lowercased text, in id order.'''
+    special = set(tokenizer.all_special_tokens)
+    for token, token_id in sorted(tokenizer.encoder.items(), key=lambda item: item[1]):
+        # entries that aren't lowercase stand for control bytes, and can't be keys of a WordDB
+        if token not in special and token == token.lower():
+            yield token, token_id
+
+
+def batches(iterable, n):
+    it = iter(iterable)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
+
+
+def main():
+    args = parse_args()
+    db_path = args.output or token_db.default_path()
+    model = clip_model.TextModel(args.device)
+    bpe.write_merges(token_db.merges_path(db_path), model.tokenizer.bpe_ranks)
+
+    # an interrupted build continues with the tokens that are missing
+    tdb = WordDB(db_path)
+    tdb.set_model(clip_model.MODEL_NAME)
+    known = tdb.words()
+    todo = [(token, token_id) for token, token_id in vocabulary(model.tokenizer) if token not in known]
+    count = 0
+    start = time.perf_counter()
+    for batch in batches(todo, args.batch_size):
+        embs = model.embeddings_from_token_ids([token_id for _, token_id in batch])
+        tdb.insert_many(zip((token for token, _ in batch), embs))
+        count += len(batch)
+        elapsed = time.perf_counter() - start
+        print(f'{count}/{len(todo)} tokens, {count / elapsed:.1f} tokens/s', file=sys.stderr)
+
+    print('Ranking colors', file=sys.stderr)
+    neurocat_build_rankings.build(ColorAssoc(), tdb)
+    neurocat_export_worddb.export(tdb, word_store.store_path(db_path))
+    print(f'Token database with {tdb.count()} tokens written to {db_path}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,36 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: MIT
 import argparse
+import itertools
+import json
+import multiprocessing
+import os
 import sys
+import time
 
 from impl import clip_model
+from impl import resource
 from impl import word_db
 
-def words(filename):
-    words = set()
+def words(filename, offset=0):
+    '''
+    Yields (offset, word) for the words in a file, or standard input if `filename` is '-',
+    where offset is the byte offset just past the line of the word. Reading starts at `offset`.
+    '''
     if filename == '-':
-        f = sys.stdin
+        f = sys.stdin.buffer
     else:
-        f = open(filename, 'r')
+        f = open(filename, 'rb')
+        f.seek(offset)
     with f:
         for line in f:
-            word = line.strip()
+            offset += len(line)
+            word = line.decode().strip()
             if word.startswith('#'): # skip comments
                 continue
             if "'" in word or "-" in word or '.' in word or ' ' in word: # not single words, of very little use
                 continue
-            yield word
+            yield offset, word
 
 
 def parse_args():
@@ -36,19 +47,136 @@ def parse_args():
         default="cuda",
         help="Pytorch device to use. Default is 'cuda'. Use 'cpu' to not use GPU acceleration (slow)."
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=64,
+        help="Number of words to embed and insert at once. Default is 64."
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=0,
+        help="Number of CPU worker processes to compute embeddings in. Default is 0, compute in-process on --device."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of pytorch threads per worker process. Default is to divide the CPUs between the workers."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="Checkpoint file to resume an interrupted build from. Default is data/word-embeddings.checkpoint. Not used for standard input."
+    )
     return parser.parse_args()
 
 
+def new_words(known, words):
+    '''Filter out words already in the database, or seen before. Yields (input offset, word).'''
+    for pos, word in words:
+        key = word.lower()
+        if key in known: # don't bother computing the embedding if word already in
+            continue
+        known.add(key)
+        yield pos, word
+
+
+def batches(iterable, n):
+    it = iter(iterable)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
+
+
+class Checkpoint:
+    '''
+    Records how far into the input file the build has progressed, as a byte offset, so that
+    resuming can seek there. Everything before the checkpointed offset has been committed to the database.
+    '''
+    def __init__(self, path, filename):
+        self.path = path
+        self.filename = os.path.abspath(filename)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return 0
+        if state['filename'] != self.filename:
+            return 0
+        return state.get('offset', 0)
+
+    def save(self, offset):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'filename': self.filename, 'offset': offset}, f)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+_worker_model = None
+
+def _worker_init(threads):
+    import torch
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = clip_model.TextModel('cpu')
+
+def _worker_embed(batch):
+    return batch, _worker_model.embeddings_from_texts([word for _, word in batch])
+
+
 def main():
     args = parse_args()
-    model = clip_model.TextModel(args.device)
     db = word_db.WordDB()
+    db.set_model(clip_model.MODEL_NAME)
+
+    checkpoint = None
+    start_offset = 0
+    if args.filename != '-':
+        checkpoint = Checkpoint(args.checkpoint or resource.filename('word-embeddings.checkpoint'), args.filename)
+        start_offset = checkpoint.load()
+        if start_offset:
+            print(f'Resuming from input byte {start_offset}', file=sys.stderr)
 
-    for word in words(args.filename):
-        if db.lookup(word) is None: # don't bother computing the embedding if word already in
+    todo = batches(new_words(db.words(), words(args.filename, start_offset)), args.batch_size)
+
+    if args.jobs > 0:
+        threads = args.threads or max(1, os.cpu_count() // args.jobs)
+        pool = multiprocessing.Pool(args.jobs, initializer=_worker_init, initargs=(threads,))
+        results = pool.imap(_worker_embed, todo)
+    else:
+        pool = None
+        model = clip_model.TextModel(args.device)
+        results = ((batch, model.embeddings_from_texts([word for _, word in batch])) for batch in todo)
+
+    # this process is the only writer; workers only compute embeddings
+    count = 0
+    start = time.perf_counter()
+    for batch, embs in results:
+        db.insert_many(zip((word for _, word in batch), embs))
+        if checkpoint is not None:
+            checkpoint.save(batch[-1][0])
+
+        for _, word in batch:
             print(word)
-            emb = model.embedding_from_text(word)
-            db.insert(word, emb)
+        count += len(batch)
+        elapsed = time.perf_counter() - start
+        print(f'{count} words, {count / elapsed:.1f} words/s', file=sys.stderr)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if checkpoint is not None:
+        checkpoint.remove()
 
 if __name__ == '__main__':
     main()
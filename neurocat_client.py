@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Thin client for neurocat_server.py. Falls back to running neurocat.py directly if no server is running.
+'''
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+
+from impl import daemon
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Show a file in CLIP neural association colors, using a running neurocat server.")
+    parser.add_argument(
+        "filename",
+        nargs='?',
+        default='-',
+        help="Name of file to process. The default is '-' (standard input)."
+    )
+    parser.add_argument(
+        "-m", "--multicolor",
+        type=int,
+        default=1,
+        help='Multiple colors per word instead of onlye one color per word. Value is 0 or 1. Default is 1.',
+    )
+    parser.add_argument(
+        "--colors",
+        choices=['truecolor', '256', '16'],
+        default=daemon.OPTIONS['colors'],
+        help='Terminal color mode, see neurocat.py.',
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=None,
+        help=f"Path of the server socket. The default is {daemon.socket_path()}.",
+    )
+    return parser.parse_args()
+
+
+def send_input(sock, fd):
+    # os.read returns whatever is available, so interactive input is passed on immediately
+    try:
+        while data := os.read(fd, 1 << 16):
+            sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass # server went away, the receiving side will notice
+
+
+def run_local(args):
+    '''Do it ourselves: replace this process by neurocat.py.'''
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'neurocat.py')
+    extra = ['--line-buffered'] if args.filename == '-' else []
+    os.execv(sys.executable, [sys.executable, script, *extra, '-m', str(args.multicolor), '--colors', args.colors, args.filename])
+
+
+def main():
+    args = parse_args()
+
+    path = args.socket or daemon.socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        daemon.check_socket(path)
+        sock.connect(path)
+    except PermissionError as e:
+        print(f'neurocat: {e}, not using the server', file=sys.stderr)
+        run_local(args)
+    except (FileNotFoundError, ConnectionRefusedError):
+        run_local(args) # no server
+
+    sock.sendall(json.dumps({'multicolor': args.multicolor, 'colors': args.colors}).encode() + b'\n')
+
+    if args.filename != '-':
+        f = open(args.filename, 'rb')
+    else:
+        f = sys.stdin.buffer
+    sender = threading.Thread(target=send_input, args=(sock, f.fileno()), daemon=True)
+    sender.start()
+
+    reply = sock.makefile('rb')
+    status = json.loads(reply.readline() or '{"error": "no reply from server"}')
+    if status['error'] is not None:
+        print(f'neurocat: server: {status["error"]}', file=sys.stderr)
+        sys.exit(1)
+
+    out = sys.stdout.buffer
+    while data := reply.read1(1 << 16):
+        out.write(data)
+        out.flush()
+
+
+if __name__ == '__main__':
+    main()
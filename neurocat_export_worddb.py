@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Export the word database to a compact, memory-mapped read-only store. To copy words between
+databases, see neurocat_worddb.py dump and load.
+'''
+import argparse
+import sys
+
+import numpy as np
+
+from impl import quantize
+from impl import resource
+from impl import word_store
+from impl.word_db import WordDB
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export neurocat word database to a compact read-only store, as used for coloring. To copy words between databases, see neurocat_worddb.py dump and load instead.")
+    parser.add_argument(
+        "--db",
+        type=str,
+        default=None,
+        help="Word database to export. The default is data/word-embeddings.db.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Store directory to write. The default is next to the database, with the extension '.store'.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=word_store.FORMATS,
+        default='float16',
+        help="Embedding format: float16 (default), int8 (about half the size) or pq (product quantization, dimension / subspaces bytes per word). "
+             "Check the effect of quantization with neurocat_store_agreement.py.",
+    )
+    parser.add_argument(
+        "--subspaces",
+        type=int,
+        default=96,
+        help="Number of subspaces for --format pq, must divide the embedding dimension. Default is 96.",
+    )
+    parser.add_argument(
+        "--train-size",
+        type=int,
+        default=32768,
+        help="Number of embeddings to train the product quantization codebook on. Default is 32768.",
+    )
+    return parser.parse_args()
+
+
+def training_sample(wdb, size, seed=0):
+    '''Random sample of about `size` embeddings from the database.'''
+    rng = np.random.default_rng(seed)
+    fraction = min(size / wdb.count(), 1.0)
+    sample = []
+    for _, m in wdb.embeddings():
+        sample.append(m[rng.random(len(m)) < fraction])
+    return np.concatenate(sample)
+
+
+def export(wdb, output, format='float16', subspaces=96, train_size=32768):
+    word_store.remove(output) # first, so that a wrong --output fails before the work is done
+    count = wdb.count()
+    dim = wdb.dim()
+    codebook = None
+    if format == 'pq':
+        codebook = quantize.train_pq(training_sample(wdb, train_size), subspaces)
+
+    # only carry over the ranking table if it's complete and current
+    rankings = None
+    fingerprint = wdb.get_meta('rankings_fingerprint')
+    if fingerprint is not None and wdb.rankings_status(fingerprint) == 'ok':
+        rankings = (fingerprint, wdb.rankings())
+
+    word_store.write(output, count, wdb.max_word_length(encoded=True), dim, wdb.embeddings(sort=True), rankings, format, codebook,
+        wdb.get_meta('model'))
+
+
+def main():
+    args = parse_args()
+    db_path = args.db or resource.filename('word-embeddings.db')
+    output = args.output or word_store.store_path(db_path)
+    wdb = WordDB(db_path)
+
+    if wdb.count() == 0:
+        print(f'{db_path}: word database is empty', file=sys.stderr)
+        sys.exit(1)
+    if args.format == 'pq' and wdb.dim() % args.subspaces:
+        print(f'--subspaces {args.subspaces} does not divide the embedding dimension {wdb.dim()}', file=sys.stderr)
+        sys.exit(1)
+    try:
+        export(wdb, output, args.format, args.subspaces, args.train_size)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(f'Exported {wdb.count()} words to {output} ({args.format})', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
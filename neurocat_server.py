@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Long-running neurocat server. Keeps the word database, colors and word cache loaded,
+and colors text for neurocat_client.py over a Unix domain socket.
+'''
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import pathlib
+import signal
+import sys
+
+from impl import daemon
+from impl import resource
+from impl import word_store
+from impl.color_assoc import ColorAssoc
+from impl.fun_color import Colorizer, WordCache, palette
+from impl.term_util import AnsiWriter, COLOR_MODES
+from impl.word_db import WordDB
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve neurocat coloring over a Unix domain socket.")
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=None,
+        help=f"Path of the socket to listen on. The default is {daemon.socket_path()}.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1 << 20,
+        help='Number of colored words to keep in memory, shared between all clients. Default is 1048576.',
+    )
+    return parser.parse_args()
+
+
+def parse_options(header):
+    '''Options from the header line of a request, with defaults. Raises ValueError if they are invalid.'''
+    options = json.loads(header)
+    if not isinstance(options, dict):
+        raise ValueError('header is not a JSON object')
+    options = {**daemon.OPTIONS, **options}
+    if options['multicolor'] not in (0, 1):
+        raise ValueError('multicolor must be 0 or 1')
+    if options['colors'] not in COLOR_MODES:
+        raise ValueError(f'colors must be one of {", ".join(COLOR_MODES)}')
+    return options
+
+
+class Server:
+    def __init__(self, cache_size):
+        self.cas = ColorAssoc()
+        self.cache_size = cache_size
+        self.palette = palette(self.cas)
+        self.open_db()
+        # coloring happens in a thread of its own, so that a large request doesn't hold up the
+        # other clients; only one, as the word database and cache can't be shared between threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    def db_version(self):
+        '''Modification times of the word database and its store, which change when either is rebuilt.'''
+        db_path = resource.filename('word-embeddings.db')
+        version = []
+        for path in (db_path, word_store.store_path(db_path) / 'meta.json'):
+            try:
+                version.append(path.stat().st_mtime_ns)
+            except FileNotFoundError:
+                version.append(None)
+        return version
+
+    def open_db(self):
+        '''(Re)open the word database, which is opened immutable, and start with an empty cache.'''
+        self.version = self.db_version()
+        self.wdb = WordDB(readonly=True)
+        rankings = self.wdb.rankings_status(self.cas.fingerprint)
+        if rankings == 'stale':
+            print('neurocat: color ranking table is out of date, run neurocat_build_rankings.py', file=sys.stderr)
+        self.ranked = rankings == 'ok'
+        self.cache = WordCache(self.cache_size)
+
+    def color(self, options, out, data):
+        '''Color complete lines of input, returning the encoded output. Runs in the coloring thread.'''
+        if self.db_version() != self.version:
+            print('neurocat: word database changed, reopening', file=sys.stderr)
+            self.open_db()
+        colorizer = Colorizer(self.cas, self.wdb, fallback=True, multicolor=bool(options['multicolor']),
+            ranked=self.ranked, cache=self.cache)
+        lines = data.decode(daemon.ENCODING, daemon.ERRORS).split('\n')[:-1]
+        colorizer.prepare(lines)
+        return ''.join(out.render_line(colorizer.line_spans(line)) for line in lines).encode(daemon.ENCODING, daemon.ERRORS)
+
+    async def send(self, options, out, writer, data):
+        '''Color complete lines of input in the coloring thread, and send them.'''
+        if not data:
+            return
+        loop = asyncio.get_running_loop()
+        writer.write(await loop.run_in_executor(self.executor, self.color, options, out, data))
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                options = parse_options(await reader.readline())
+            except ValueError as e:
+                writer.write(json.dumps({'error': f'bad request: {e}'}).encode() + b'\n')
+                await writer.drain()
+                return
+            writer.write(json.dumps({'error': None}).encode() + b'\n')
+            out = AnsiWriter(None, self.palette, colors=options['colors']) # only for render_line
+
+            pending = b''
+            while data := await reader.read(1 << 16):
+                data = pending + data
+                end = data.rfind(b'\n') + 1
+                pending = data[end:]
+                await self.send(options, out, writer, data[:end])
+            if pending: # last line without newline
+                await self.send(options, out, writer, pending + b'\n')
+        except (ConnectionError, ValueError) as e:
+            print(f'neurocat: client error: {e}', file=sys.stderr)
+        finally:
+            writer.close()
+
+
+async def serve(server, path):
+    listener = await asyncio.start_unix_server(server.handle, path=path)
+    # stop cleanly on SIGTERM and SIGINT, so that main removes the socket
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    async with listener:
+        await stop.wait()
+
+
+def main():
+    args = parse_args()
+    path = pathlib.Path(args.socket or daemon.socket_path())
+    try:
+        daemon.make_socket_dir(path)
+    except PermissionError as e:
+        print(f'neurocat: {e}, not listening there', file=sys.stderr)
+        sys.exit(1)
+    server = Server(args.cache_size)
+
+    path.unlink(missing_ok=True) # stale socket from a previous run
+    os.umask(0o077)
+    try:
+        asyncio.run(serve(server, path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        path.unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,16 @@
 # neural color spectrum
 # SPDX-License-Identifier: MIT
 import argparse
+import itertools
 import sys
+import time
 
 import numpy as np
 
 from impl.color_assoc import ColorAssoc
-from impl.clip_util import normalize
-from impl.color_util import lerp, normalize_color, hsv_to_rgb8
-from impl.term_util import gauge, BARS_H
+from impl.color_util import normalize_color, hsv_to_rgb8
+from impl.stats import Stats, profile
+from impl.term_util import BARS_H
 from impl.word_db import WordDB
 
 # XXX actual argument parsing.
@@ -37,142 +39,157 @@ subtract_abstract = True
 
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="Print 'CLIP neural spectrum' for a word.")
+    parser = argparse.ArgumentParser(description="Print 'CLIP neural spectrum' for words.")
     parser.add_argument(
-        "word",
+        "words",
         type=str,
-        help='The word to use',
+        nargs='*',
+        help='The words to use',
     )
-    return parser.parse_args()
-
-
-def main():
-    args = parse_args()
-    wdb = WordDB()
-    cas = ColorAssoc(subtract_abstract)
-
-    m = wdb.lookup(args.word)
-
-    if m is None:
-        print(f'The word {args.word} is not in the database')
-        sys.exit(1)
-
-    scores, ac_score = cas.compute_scores(m)
-
-    ########### Mapping of ranking and dot products to [0..1].
-
-    def mapping_expdist(scores):
-        '''
-        negative exponential mapping (noisy)
-        displays strongest associations
-        '''
-        if cas.subtract_abstract:
-            steepness = 35.0
-        else:
-            steepness = 48.5
-
-        scores_norm = np.exp(scores * steepness)
-        scores_norm /= max(scores_norm)
-        return np.clip(scores_norm, 0.0, 1.0)
-
-    def mapping_expdist_norm(scores, ac_score):
-        '''
-        '''
-        min_score = min(min(scores), ac_score)
-        max_score = max(max(scores), ac_score)
-
-        scores_norm = (scores - min_score) / (max_score - min_score)
-
-        steepness = 4.0
-        scores_norm = np.exp(scores_norm * steepness)
-        scores_norm /= max(scores_norm)
-        return np.clip(scores_norm, 0.0, 1.0)
-
-    def mapping_polynomial(scores, ac_score, cutoff=0.50, power=1.6):
-        '''
-        negative exponential mapping (noisy)
-        displays strongest associations
-        '''
-        # count ac_score in range determination
-        # even though it's not displayed as an actual color
-        min_score = min(min(scores), ac_score)
-        max_score = max(max(scores), ac_score)
-
-        if (max_score - min_score) < 0.01:
-            # not possible to significantly distinguish anything
-            return np.ones(len(scores))
-        scores_norm = (scores - min_score) / (max_score - min_score)
-        scores_norm -= cutoff # cut off lower half
-        scores_norm = np.maximum(scores_norm, 0.0)
-        scores_norm /= (1.0 - cutoff)
-
-        scores_norm = scores_norm ** power
-        return np.clip(scores_norm, 0.0, 1.0)
-
-    def mapping_rank(scores):
-        '''
-        assigned based on simple rank
-        this loses information and it would be good to incorporate somehow the distances
-        after spending a long time trying to get the scaling right, this seems to work surprisngly well
-        '''
-        ranking = np.argsort(scores)
-        scores_norm = np.zeros([len(ranking)])
-        for i, r in enumerate(ranking):
-            scores_norm[r] = np.exp(-(1.0 - i / len(ranking)) * 10.0)
-
-        # clamp relative scores to 0..1
-        return np.clip(scores_norm, 0.0, 1.0)
-
-    def mapping_binary(scores, threshold=0.0):
-        '''
-        all colors with any positive association as full intensity
-        doesn't show strength of association but shows the color better
-
-        because of this it works well with spectrum_norm=False
-        '''
-        scores_norm = np.zeros(len(scores))
-        for i in range(len(scores)):
-            if scores[i] > threshold:
-                scores_norm[i] = 1.0
-        return scores_norm
-
-    def print_statistics(scores):
-        # Print some statistics
-        min_score = min(scores)
-        max_score = max(scores)
-        median = np.percentile(scores, 50)
-        print(f'median {median * 100.0:3.1f} range [{(min_score) * 100.0:5.1f}..{(max_score) * 100.0:5.1f}] max-min {(max_score - min_score) * 100.0:5.1f} max-median {(max_score-median) * 100:5.1f}')
-
-        #bins, edges = np.histogram(scores)
-        #print(list(bins))
-        #print(list(edges * 100.0))
-
-    print_statistics(scores)
-
-    #scores_norm = mapping_rank(scores)
-    #scores_norm = mapping_expdist(scores)
-    scores_norm = mapping_expdist_norm(scores, ac_score)
-    #scores_norm = mapping_polynomial(scores, ac_score)
-    #scores_norm = mapping_binary(scores)
-
-    #### Visualization
-
-    def gen_greyramp(n, darkest=0, rep=1):
-        for val in np.linspace(0.0, 1.0, n):
-            col = tuple(max(comp, darkest) for comp in hsv_to_rgb8(0.0, 0.0, val))
-            for _ in range(rep):
-                yield col
-
-    def gen_spectrum(n, sat, val):
-        for hue in np.linspace(0.0, 1.0, n, endpoint=False):
-            yield hsv_to_rgb8(hue, sat, val)
-
-    class FixedGlyph:
-        def __init__(self, fg, bg, glyph):
-            self.fg = fg
-            self.bg = bg
-            self.glyph = glyph
-
+    parser.add_argument(
+        "--file",
+        type=str,
+        default=None,
+        help="Read words from this file, one per line ('-' for standard input), after the words on the command line.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1024,
+        help="Number of words to look up and score at once. Default is 1024.",
+    )
+    parser.add_argument(
+        "--stats",
+        action='store_true',
+        help='Print time spent per stage to standard error at exit.',
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar='FILE',
+        help='Run under cProfile and write the profile to FILE.',
+    )
+    args = parser.parse_args()
+    if not args.words and args.file is None:
+        parser.error('no words given')
+    return args
+
+
+########### Mapping of ranking and dot products to [0..1].
+
+def mapping_expdist(cas, scores):
+    '''
+    negative exponential mapping (noisy)
+    displays strongest associations
+    '''
+    if cas.subtract_abstract:
+        steepness = 35.0
+    else:
+        steepness = 48.5
+
+    scores_norm = np.exp(scores * steepness)
+    scores_norm /= max(scores_norm)
+    return np.clip(scores_norm, 0.0, 1.0)
+
+def mapping_expdist_norm(scores, ac_score):
+    '''
+    '''
+    min_score = min(min(scores), ac_score)
+    max_score = max(max(scores), ac_score)
+
+    scores_norm = (scores - min_score) / (max_score - min_score)
+
+    steepness = 4.0
+    scores_norm = np.exp(scores_norm * steepness)
+    scores_norm /= max(scores_norm)
+    return np.clip(scores_norm, 0.0, 1.0)
+
+def mapping_polynomial(scores, ac_score, cutoff=0.50, power=1.6):
+    '''
+    negative exponential mapping (noisy)
+    displays strongest associations
+    '''
+    # count ac_score in range determination
+    # even though it's not displayed as an actual color
+    min_score = min(min(scores), ac_score)
+    max_score = max(max(scores), ac_score)
+
+    if (max_score - min_score) < 0.01:
+        # not possible to significantly distinguish anything
+        return np.ones(len(scores))
+    scores_norm = (scores - min_score) / (max_score - min_score)
+    scores_norm -= cutoff # cut off lower half
+    scores_norm = np.maximum(scores_norm, 0.0)
+    scores_norm /= (1.0 - cutoff)
+
+    scores_norm = scores_norm ** power
+    return np.clip(scores_norm, 0.0, 1.0)
+
+def mapping_rank(scores):
+    '''
+    assigned based on simple rank
+    this loses information and it would be good to incorporate somehow the distances
+    after spending a long time trying to get the scaling right, this seems to work surprisngly well
+    '''
+    ranking = np.argsort(scores)
+    scores_norm = np.zeros([len(ranking)])
+    for i, r in enumerate(ranking):
+        scores_norm[r] = np.exp(-(1.0 - i / len(ranking)) * 10.0)
+
+    # clamp relative scores to 0..1
+    return np.clip(scores_norm, 0.0, 1.0)
+
+def mapping_binary(scores, threshold=0.0):
+    '''
+    all colors with any positive association as full intensity
+    doesn't show strength of association but shows the color better
+
+    because of this it works well with spectrum_norm=False
+    '''
+    scores_norm = np.zeros(len(scores))
+    for i in range(len(scores)):
+        if scores[i] > threshold:
+            scores_norm[i] = 1.0
+    return scores_norm
+
+def statistics_lines(scores):
+    # Print some statistics, for each row of scores
+    min_scores = scores.min(axis=1)
+    max_scores = scores.max(axis=1)
+    medians = np.percentile(scores, 50, axis=1)
+    return [f'median {median * 100.0:3.1f} range [{(min_score) * 100.0:5.1f}..{(max_score) * 100.0:5.1f}] max-min {(max_score - min_score) * 100.0:5.1f} max-median {(max_score-median) * 100:5.1f}'
+        for min_score, max_score, median in zip(min_scores, max_scores, medians)]
+
+    #bins, edges = np.histogram(scores)
+    #print(list(bins))
+    #print(list(edges * 100.0))
+
+
+########### Visualization
+
+def gen_greyramp(n, darkest=0, rep=1):
+    for val in np.linspace(0.0, 1.0, n):
+        col = tuple(max(comp, darkest) for comp in hsv_to_rgb8(0.0, 0.0, val))
+        for _ in range(rep):
+            yield col
+
+def gen_spectrum(n, sat, val):
+    for hue in np.linspace(0.0, 1.0, n, endpoint=False):
+        yield hsv_to_rgb8(hue, sat, val)
+
+class FixedGlyph:
+    def __init__(self, fg, bg, glyph):
+        self.fg = fg
+        self.bg = bg
+        self.glyph = glyph
+
+def layout(cas):
+    '''
+    The rows of the spectrum, independent of the word, so computed once. Every row is
+    (mode, cells, positions, color indices, colors): the fixed cells as strings, and for each
+    cell that shows a color of `cas` its position in cells, color index and color to display.
+    '''
     # value/brightness gradient
     blvl = [
         FixedGlyph((0x40, 0x40, 0x40), (0, 0, 0), '▕'),
@@ -210,56 +227,168 @@ def main():
         (0, [None] + hlvlc),
     ]
 
+    rows = []
     for mode, row in color_rows:
-        s = []
+        cells = []
+        positions = []
+        indices = []
+        colors = []
         for col in row:
             if col is None:
-                s.append(' ')
-                continue
-            if isinstance(col, FixedGlyph):
-                s.append(f'\x1b[38;2;{col.fg[0]};{col.fg[1]};{col.fg[2]};48;2;{col.bg[0]};{col.bg[1]};{col.bg[2]}m{col.glyph}\x1b[0m')
-                continue
-            idx = cas.rgbs.index(col)
-            ii = min(1.0, max(0.0, scores_norm[idx]))
-
-            if col == (0, 0, 0):
-                col = black_substitute
-            if mode == 2: # top row of graph
-                fg = col
-                bg = chart_bg
-                glyph = BARS_H[max(min(int(ii * 17) - 8, 8), 0)]
-            elif mode == 1: # bottom row of graph
-                fg = col
-                bg = chart_bg
-                glyph = BARS_H[max(min(int(ii * 17), 8), 0)]
+                cells.append(' ')
+            elif isinstance(col, FixedGlyph):
+                cells.append(f'\x1b[38;2;{col.fg[0]};{col.fg[1]};{col.fg[2]};48;2;{col.bg[0]};{col.bg[1]};{col.bg[2]}m{col.glyph}\x1b[0m')
             else:
+                idx = cas.nearest_index(col) # the palette may be denser than the spectrum
+                if col == (0, 0, 0):
+                    col = black_substitute
                 # normalize color
-                if spectrum_norm:
+                if mode == 0 and spectrum_norm:
                     col = normalize_color(col, 255)
-
-                if color_bars:
-                    #fg = col
-                    bg = chart_bg
-                    fg = lerp(spectro_bg, col, ii)
-                    glyph = BARS_H[min(int(ii * len(BARS_H)), len(BARS_H) - 1)]
+                positions.append(len(cells))
+                cells.append(None) # filled in by render
+                indices.append(idx)
+                colors.append(col)
+        rows.append((mode, cells, positions, np.array(indices, dtype=np.intp), np.array(colors, dtype=np.float32).reshape(-1, 3)))
+    return rows
+
+def _lerp(rgb1, rgb2, w):
+    '''color_util.lerp for arrays of colors and weights.'''
+    rgb1 = np.array(rgb1, dtype=np.float32)
+    return (rgb1 + w[..., None] * (rgb2 - rgb1)).astype(int)
+
+def _pack(rgb):
+    return (rgb[..., 0].astype(np.int64) << 16) | (rgb[..., 1].astype(np.int64) << 8) | rgb[..., 2]
+
+_cell_cache = {} # rendered cells by key, see render
+
+def render(rows, scores_norm):
+    '''
+    Render the spectra for a matrix of normalized scores (one word per row), returning
+    the lines of text for every word.
+    '''
+    words = [[] for _ in range(len(scores_norm))]
+    for mode, cells, positions, indices, colors in rows:
+        if not positions:
+            for lines in words:
+                lines.append(''.join(cells))
+            continue
+        ii = np.clip(scores_norm[:, indices], 0.0, 1.0)
+        bg = np.broadcast_to(np.array(chart_bg), ii.shape + (3,))
+
+        if mode == 2: # top row of graph
+            fg = np.broadcast_to(colors.astype(int), ii.shape + (3,))
+            glyphs = np.clip((ii * 17).astype(int) - 8, 0, 8)
+        elif mode == 1: # bottom row of graph
+            fg = np.broadcast_to(colors.astype(int), ii.shape + (3,))
+            glyphs = np.clip((ii * 17).astype(int), 0, 8)
+        else:
+            if color_bars:
+                fg = _lerp(spectro_bg, colors, ii)
+                glyphs = np.minimum((ii * len(BARS_H)).astype(int), len(BARS_H) - 1)
+            else:
+                fg = np.zeros(ii.shape + (3,), dtype=int)
+                if spectrum_bw:
+                    bg = _lerp(spectro_bg, np.full(colors.shape, 255, dtype=np.float32), ii)
                 else:
-                    #bg = lerp((0, 0, 0), col, ii)
-                    #bg = (0, 0, 0)
-                    fg = (0, 0, 0)
-                    #fg = lerp(spectro_bg, (255, 255, 255), ii)
-                    if spectrum_bw:
-                        bg = lerp(spectro_bg, (255, 255, 255), ii)
-                    else:
-                        bg = lerp(spectro_bg, col, ii)
-                    #glyph = '·' 
-                    #glyph = '■'
-                    #fg = (0, 0, 0)
-                    #bg = col
-                    glyph = ' '
-
-
-            s.append(f'\x1b[38;2;{fg[0]};{fg[1]};{fg[2]};48;2;{bg[0]};{bg[1]};{bg[2]}m{glyph}\x1b[0m')
-        print(''.join(s))
+                    bg = _lerp(spectro_bg, colors, ii)
+                glyphs = np.zeros(ii.shape, dtype=int) # BARS_H[0] is a space
+
+        # one number per cell, so that rendered cells can be reused
+        keys = (glyphs.astype(np.int64) << 48) | _pack(fg) << 24 | _pack(bg)
+        for lines, word_keys in zip(words, keys.tolist()):
+            row = list(cells)
+            for pos, key in zip(positions, word_keys):
+                cell = _cell_cache.get(key)
+                if cell is None:
+                    f0, f1, f2 = (key >> 40) & 0xff, (key >> 32) & 0xff, (key >> 24) & 0xff
+                    b0, b1, b2 = (key >> 16) & 0xff, (key >> 8) & 0xff, key & 0xff
+                    cell = _cell_cache[key] = f'\x1b[38;2;{f0};{f1};{f2};48;2;{b0};{b1};{b2}m{BARS_H[key >> 48]}\x1b[0m'
+                row[pos] = cell
+            lines.append(''.join(row))
+    return words
+
+
+def read_words(args):
+    '''Iterate over the words from the command line and --file.'''
+    yield from args.words
+    if args.file is not None:
+        f = sys.stdin if args.file == '-' else open(args.file, 'r')
+        with f:
+            for line in f:
+                word = line.strip()
+                if word:
+                    yield word
+
+
+def show_spectrum(args, stats):
+    clock = time.perf_counter
+    start = clock()
+    wdb = WordDB(readonly=True)
+    cas = ColorAssoc(subtract_abstract)
+    rows = layout(cas)
+    if stats is not None:
+        stats.add_time('load', clock() - start)
+
+    # a heading per word, unless there is only one
+    words = read_words(args)
+    batch = list(itertools.islice(words, args.batch_size))
+    headings = len(batch) > 1 or args.file is not None
+    missing = 0
+    while batch:
+        start = clock()
+        m, found = wdb.lookup_many(batch)
+        if stats is not None:
+            stats.add_time('lookup', clock() - start)
+            stats.count('lookup exact hit', int(found.sum()))
+            stats.count('lookup exact miss', int(len(found) - found.sum()))
+            start = clock()
+        scores, ac_scores = cas.compute_scores_batch(m[found])
+        #scores_norm = [mapping_rank(word_scores) for word_scores in scores]
+        #scores_norm = [mapping_expdist(cas, word_scores) for word_scores in scores]
+        scores_norm = [mapping_expdist_norm(word_scores, ac_score) for word_scores, ac_score in zip(scores, ac_scores)]
+        #scores_norm = [mapping_polynomial(word_scores, ac_score) for word_scores, ac_score in zip(scores, ac_scores)]
+        #scores_norm = [mapping_binary(word_scores) for word_scores in scores]
+        scores_norm = np.array(scores_norm).reshape(scores.shape)
+        if stats is not None:
+            stats.add_time('score', clock() - start)
+
+        start = clock()
+        spectra = iter(zip(statistics_lines(scores), render(rows, scores_norm)))
+        out = []
+        for word, ok in zip(batch, found):
+            if not ok:
+                print(f'The word {word} is not in the database', file=sys.stderr if headings else sys.stdout)
+                missing += 1
+                continue
+            statistics, lines = next(spectra)
+            if headings:
+                out.append(word)
+            out.append(statistics)
+            out += lines
+        text = '\n'.join(out) + '\n' if out else ''
+        sys.stdout.write(text)
+        if stats is not None:
+            stats.add_time('render', clock() - start)
+            stats.count('bytes out', len(text.encode()))
+        batch = list(itertools.islice(words, args.batch_size))
+
+    if missing:
+        sys.exit(1)
+
+
+def main():
+    args = parse_args()
+    stats = Stats() if args.stats else None
+
+    try:
+        if args.profile:
+            profile(lambda: show_spectrum(args, stats), args.profile)
+        else:
+            show_spectrum(args, stats)
+    finally:
+        if stats is not None:
+            stats.report()
 
 
 if __name__ == '__main__':
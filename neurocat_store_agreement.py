@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Report how well the color rankings from a (quantized) word store agree with the float16
+embeddings in the word database.
+'''
+import argparse
+import pathlib
+import sys
+
+import numpy as np
+
+from impl import resource
+from impl import word_store
+from impl.color_assoc import ColorAssoc, colorfulness, rank
+from impl.word_db import WordDB
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare color rankings of a word store to the word database.")
+    parser.add_argument(
+        "--db",
+        type=str,
+        default=None,
+        help="Word database to compare against. The default is data/word-embeddings.db.",
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=None,
+        help="Store directory to check. The default is next to the database, with the extension '.store'.",
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=5,
+        help="Number of top colors to compare. Default is 5.",
+    )
+    return parser.parse_args()
+
+
+def agreement(cas, wdb, store, top_k, chunk_size=4096):
+    '''Return (top-1 agreement, mean top-k overlap, mean absolute colorfulness difference), over all words.'''
+    top1 = overlap = cf_diff = 0.0
+    count = 0
+    for (words, m), (store_words, scores, ac_scores) in zip(wdb.embeddings(chunk_size, sort=True), store.scores_chunks(cas, chunk_size)):
+        if words != store_words:
+            raise ValueError('Store does not contain the same words as the database, re-export it')
+        ref_scores, ref_ac_scores = cas.compute_scores_batch(m)
+        ref = rank(ref_scores, top_k)
+        ranked = rank(scores, top_k)
+        top1 += np.sum(ref[:, 0] == ranked[:, 0])
+        overlap += np.sum((ranked[:, :, None] == ref[:, None, :]).any(axis=2)) / ref.shape[1]
+        cf_diff += np.sum(np.abs(colorfulness(ref_scores, ref_ac_scores) - colorfulness(scores, ac_scores)))
+        count += len(words)
+    return top1 / count, overlap / count, cf_diff / count
+
+
+def embeddings_size(path):
+    '''Size in bytes of the embedding data in a store.'''
+    return sum((path / name).stat().st_size for name in ['embeddings.npy', 'scales.npy', 'codes.npy', 'codebook.npy'] if (path / name).exists())
+
+
+def main():
+    args = parse_args()
+    db_path = args.db or resource.filename('word-embeddings.db')
+    store_path = pathlib.Path(args.store or word_store.store_path(db_path))
+    wdb = WordDB(db_path)
+    store = word_store.WordStore(store_path)
+    if len(store) != wdb.count():
+        print(f'{store_path}: store has {len(store)} words, database {wdb.count()}; re-export it', file=sys.stderr)
+        sys.exit(1)
+
+    top1, overlap, cf_diff = agreement(ColorAssoc(), wdb, store, args.top_k)
+    print(f'format              {store.format}')
+    print(f'words               {len(store)}')
+    print(f'bytes per word      {embeddings_size(store_path) / len(store):.1f}')
+    print(f'top-1 agreement     {top1 * 100.0:.2f}%')
+    print(f'top-{args.top_k} overlap       {overlap * 100.0:.2f}%')
+    print(f'colorfulness error  {cf_diff:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Bulk dump, load and merge of word databases, to combine embeddings built on several hosts.
+To export a word database for fast reading, see neurocat_export_worddb.py instead.
+'''
+import argparse
+import pathlib
+import sys
+import time
+import zipfile
+
+from impl import resource
+from impl import word_dump
+from impl.word_db import WordDB
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dump, load and merge neurocat word databases. To write the compact read-only store used for coloring, see neurocat_export_worddb.py instead.")
+    parser.add_argument(
+        "--db",
+        type=str,
+        default=None,
+        help="Word database to work on. The default is data/word-embeddings.db.",
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('dump', help="Write all words and embeddings to an .npz file, to load into another database.")
+    command.add_argument("filename", help="File to write.")
+    command = commands.add_parser('load', help="Add the words of an .npz file made with dump that aren't in the database yet.")
+    command.add_argument("filename", help="File to read.")
+    command = commands.add_parser('merge', help="Add the words of other word databases that aren't in the database yet.")
+    command.add_argument("filenames", nargs='+', help="Word databases to merge in.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_path = args.db or resource.filename('word-embeddings.db')
+    if args.command == 'dump' and not pathlib.Path(db_path).exists():
+        print(f'{db_path}: word database not found', file=sys.stderr)
+        sys.exit(1)
+    wdb = WordDB(db_path)
+
+    start = time.perf_counter()
+    try:
+        if args.command == 'dump':
+            count = word_dump.dump(wdb, args.filename)
+            print(f'Dumped {count} words to {args.filename}', file=sys.stderr)
+        elif args.command == 'load':
+            with word_dump.Reader(args.filename) as reader:
+                wdb.check_dim(reader.dim)
+                wdb.set_model(reader.model)
+                added = wdb.add_many((word, row.tobytes()) for words, m in reader.chunks() for word, row in zip(words, m))
+            print(f'Loaded {added} of {reader.count} words from {args.filename}', file=sys.stderr)
+        elif args.command == 'merge':
+            for filename in args.filenames:
+                added = wdb.merge(filename)
+                print(f'Merged {added} words from {filename}', file=sys.stderr)
+    except (ValueError, OSError, zipfile.BadZipFile) as e:
+        print(f'{args.command}: {e}', file=sys.stderr)
+        sys.exit(1)
+    print(f'{time.perf_counter() - start:.1f} s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+'''
+Find the words most strongly associated with one or more colors.
+'''
+import argparse
+import sys
+
+from impl import resource
+from impl import reverse_index
+from impl.color_assoc import ColorAssoc
+from impl.color_util import rgb_to_hex
+from impl.fun_color import palette
+from impl.term_util import colorize
+from impl.word_db import WordDB
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find the words most associated with colors.")
+    parser.add_argument(
+        "colors",
+        nargs='*',
+        help="Colors as #rrggbb. Every color is replaced by the nearest color of the palette. With several colors, words are ranked by their mean score.",
+    )
+    parser.add_argument(
+        "-k", "--top",
+        type=int,
+        default=20,
+        help="Number of words to show. Default is 20.",
+    )
+    parser.add_argument(
+        "--db",
+        type=str,
+        default=None,
+        help="Word database to search. The default is data/word-embeddings.db.",
+    )
+    parser.add_argument(
+        "--build-index",
+        type=int,
+        default=None,
+        metavar='K',
+        help="Write an index of the top K words of every color of the palette next to the database, which is used for later queries of a single color.",
+    )
+    parser.add_argument(
+        "--no-index",
+        action='store_true',
+        help="Always scan the database, even if there is an index.",
+    )
+    parser.add_argument(
+        "--plain",
+        action='store_true',
+        help="Print only the words and scores, without colors.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_path = args.db or resource.filename('word-embeddings.db')
+    index_path = reverse_index.index_path(db_path)
+    cas = ColorAssoc()
+    wdb = WordDB(db_path, readonly=True)
+
+    if args.build_index is not None:
+        reverse_index.build(index_path, cas, wdb, args.build_index)
+        print(f'Wrote index of top {args.build_index} words per color to {index_path}', file=sys.stderr)
+    if not args.colors:
+        return
+
+    try:
+        colors = [reverse_index.parse_color(cas, spec) for spec in args.colors]
+    except ValueError:
+        print('Colors must be given as #rrggbb', file=sys.stderr)
+        sys.exit(1)
+
+    result = None
+    if len(colors) == 1 and not args.no_index:
+        try:
+            index = reverse_index.ReverseIndex(index_path)
+        except FileNotFoundError:
+            index = None
+        if index is not None and index.usable(cas, db_path, args.top):
+            result = index.top_words(colors[0], args.top)
+    if result is None:
+        result = reverse_index.top_words(cas, wdb, colors, args.top)
+
+    pal = palette(cas)
+    if not args.plain:
+        swatches = ' '.join(colorize(pal[idx], (0, 0, 0), rgb_to_hex(cas.rgbs[idx])) for idx in colors)
+        print(f'Nearest palette colors: {swatches}')
+    for word, score in result:
+        if not args.plain:
+            word = colorize(pal[colors[0]], (0, 0, 0), word)
+        print(f'{score:8.4f} {word}')
+
+
+if __name__ == '__main__':
+    main()